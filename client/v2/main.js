@@ -67,7 +67,8 @@ exportSVGBtn.onclick = () => {
 }
 
 regressionAnalysisBtn.onclick = () => {
-  regressionAnalysis();
+  var missing = missingSeries(configSelect.value, forensicsData.options[$system].benchmarks);
+  loadSeries(configSelect.value, missing).then(regressionAnalysis);
 }
 
 // TODO: Combine with drawPlot
@@ -168,7 +169,7 @@ function unsetReference() {
 }
 
 function setCommitName(commit) {
-  var timestamp = forensicsData.results.filter(o => o.commit===commit)[0].timestamp;
+  var timestamp = forensicsData.commitTimestamps[commit];
   var sha = forensicsData.options[$system].commitShas[commit];
   commitNameh4.innerHTML = `<a href="${$commitURL}/${sha}">${commit}</a> <span>${new Date(timestamp)}</span>`;
 }
@@ -244,6 +245,11 @@ function populateOptions(data) {
 function updatePlotState() {
   // TODO: loop for multiple systems
 
+  var missing = missingSeries(configSelect.value, getSelectedOptions(benchmarkSelect));
+  if (missing.length > 0) {
+    return loadSeries(configSelect.value, missing).then(updatePlotState);
+  }
+
   plotState.title = plotTitleInput.value;
   plotState.system = systemSelect.value;
   plotState.config = configSelect.value;
@@ -287,26 +293,24 @@ function updatePlotState() {
 
   // Produce the data consumed by d3.
   // Returns a list of points for a particular config
-  plotState.data = forensicsData.results.filter((o) => {
-    var bench_idx = plotState.benchmarks.indexOf(o.benchmark);
-    var commit_idx = plotState.commits.indexOf(o.commit);
-    if ((bench_idx !== -1) && (commit_idx !== -1) && (plotState.config === o.config)) {
-      return true;
-    }
-    return false;
-  }).sort(sortProc);
+  plotState.data = [];
+  plotState.commits.forEach(commit => {
+    plotState.benchmarks.forEach(bench => {
+      var o = lookupResult(plotState.config, commit, bench);
+      if (o !== undefined) {
+        plotState.data.push(o);
+      }
+    })
+  })
+  plotState.data.sort(sortProc);
 
   // Deep copy to avoid mutation issues
   plotState.data = JSON.parse(JSON.stringify(plotState.data));
 
   // Normalize results if a reference is set.
-  // Inefficient. Change the underlying data structure for
-  // faster access or maybe binary search over sorted timestamps
   function normalize(data, ref) {
     function getReferenceValue(ref, bench) {
-      return forensicsData.results.filter(o => {
-        return (o.benchmark === bench) && (o.commit === ref);
-      })[0].mean;
+      return forensicsData.firstResult.get(ref + "\0" + bench).mean;
     }
 
     plotState.benchmarks.forEach(bench => {
@@ -494,52 +498,99 @@ function drawPlot() {
   }
 }
 
+/*
+ * Results
+ */
+/* Expands the dictionary-encoded results of the compact export format */
+function decodeCompact(data) {
+  var results = [];
+  Object.keys(data.results).forEach(system => {
+    var t = data.results[system];
+    var offset = 0;
+    for (var i = 0; i < t.commit.length; i++) {
+      var count = t.count[i];
+      results.push({
+        // Not in version 2 of the layout
+        id: t.id ? t.id[i] : undefined,
+        system: system,
+        benchmark: t.benchmarks[t.benchmark[i]],
+        commit: t.commits[t.commit[i]],
+        timestamp: t.timestamps[t.commit[i]],
+        values: t.values.slice(offset, offset + count),
+        config: t.configs[t.config[i]],
+        status: t.statuses[t.status[i]],
+        min: t.min[i],
+        max: t.max[i],
+        mean: t.mean[i],
+        median: t.median[i],
+        stddev: t.stddev[i]
+      });
+      offset += count;
+    }
+  });
+  data.results = results;
+  return data;
+}
+
+/* Index the results by config, commit and benchmark instead of scanning them */
+function indexResults(data) {
+  data.resultIndex = new Map();
+  data.firstResult = new Map();
+  data.commitTimestamps = data.commitTimestamps || {};
+  addResults(data, data.results);
+}
+
+function addResults(data, results) {
+  results.forEach(o => {
+    var key = o.config + "\0" + o.commit + "\0" + o.benchmark;
+    if (!data.resultIndex.has(key)) {
+      data.resultIndex.set(key, o);
+    }
+    key = o.commit + "\0" + o.benchmark;
+    if (!data.firstResult.has(key)) {
+      data.firstResult.set(key, o);
+    }
+    if (!data.commitTimestamps.hasOwnProperty(o.commit)) {
+      data.commitTimestamps[o.commit] = o.timestamp;
+    }
+  });
+}
+
+function lookupResult(config, commit, benchmark) {
+  return forensicsData.resultIndex.get(config + "\0" + commit + "\0" + benchmark);
+}
+
+/* Numbers and statistics of the results, as plotted */
+function prepareResults(results) {
+  results.forEach(o => {
+    o.values = o.values.map(Number);
+    // Precomputed by the export, except in older forensics.json
+    if (o.mean === undefined) {
+      o.mean = d3.mean(o.values) || 0;
+      o.median = d3.median(o.values) || 0;
+      o.stddev = d3.deviation(o.values) || 0;
+      o.max = d3.max(o.values) || 0;
+      o.min = d3.min(o.values) || 0;
+    } else {
+      // null for runs without samples, plotted as 0 like above
+      ["min", "max", "mean", "median", "stddev"].forEach(s => { o[s] = o[s] || 0; });
+    }
+    // TODO: Precalculate in python on export
+    o.suite = suiteFromBenchmark(o.benchmark);
+  });
+}
+
 /* This sets up the initial state of the system */
 async function init(url) {
   fetch(url)
     .then(res => {
       if (res.status == 200) {
         res.json().then((data) => {
-          data.results.forEach(o => {
-            o.values = o.values.map(Number);
-            o.mean = d3.mean(o.values) || 0;
-            o.median = d3.median(o.values) || 0;
-            o.stddev = d3.deviation(o.values) || 0;
-            o.max = d3.max(o.values) || 0;
-            o.min = d3.min(o.values) || 0;
-            // TODO: Precalculate in python on export
-            o.suite = suiteFromBenchmark(o.benchmark);
-          });
-
-          forensicsData = data;
-          populateOptions(data);
-
-          // TODO: Do this in Python when exporting JSON
-          // Generate benchmark suites list
-          let suites = {};
-          data.options[$system].benchmarks.forEach(b => {
-            let parts = b.split('/');
-            let nParts = parts.length;
-            if (nParts === 1) {
-              var suite = b;
-            } else {
-              suite = parts.slice(0, nParts - 1).join('/');
-            }
-            if (!suites.hasOwnProperty(suite)) {
-              suites[suite] = true;
-            }
-          })
-          forensicsData.options[$system].benchmarkSuites = Object.keys(suites);
-
-          forensicsPresets = initPresets(data.options);
-          forensicsPresets.populatePresets();
-
-          if (window.location.search !== '') {
-            plotStateFromURL();
-          } else {
-            forensicsPresets.applyPreset();
-            drawPlot();
+          if (data.format === "compact") {
+            data = decodeCompact(data);
           }
+          prepareResults(data.results);
+          setup(data);
         });
       } else {
         console.log("Error getting options - ", res);
@@ -550,4 +601,185 @@ async function init(url) {
     });
 }
 
-init('/results/forensics.json');
+function setup(data) {
+  indexResults(data);
+  forensicsData = data;
+  populateOptions(data);
+
+  // TODO: Do this in Python when exporting JSON
+  // Generate benchmark suites list
+  let suites = {};
+  data.options[$system].benchmarks.forEach(b => {
+    let parts = b.split('/');
+    let nParts = parts.length;
+    if (nParts === 1) {
+      var suite = b;
+    } else {
+      suite = parts.slice(0, nParts - 1).join('/');
+    }
+    if (!suites.hasOwnProperty(suite)) {
+      suites[suite] = true;
+    }
+  })
+  forensicsData.options[$system].benchmarkSuites = Object.keys(suites);
+
+  forensicsPresets = initPresets(data.options);
+  forensicsPresets.populatePresets();
+
+  if (window.location.search !== '') {
+    plotStateFromURL();
+  } else {
+    forensicsPresets.applyPreset();
+    drawPlot();
+  }
+}
+
+/*
+ * Series
+ */
+/* With the series export, the results of a (config, benchmark) are only
+   downloaded once they are plotted.  series/index.json lists them. */
+function initSeries(index) {
+  setup({
+    options: index.options,
+    commitTimestamps: index.commitTimestamps[$system],
+    series: index.series[$system],
+    loadedSeries: new Set(),
+    results: []
+  });
+}
+
+function missingSeries(config, benchmarks) {
+  if (forensicsData.series === undefined) {
+    return [];
+  }
+  var series = forensicsData.series[config] || {};
+  return benchmarks.filter(b => series.hasOwnProperty(b) && !forensicsData.loadedSeries.has(series[b].path));
+}
+
+async function loadSeries(config, benchmarks) {
+  var paths = benchmarks.map(b => forensicsData.series[config][b].path);
+  var files = await Promise.all(paths.map(path => {
+    // The names of the path are quoted by the exporter, as for the shards, and
+    // quoted again so that their % reach the server
+    var url = '/results/series/' + path.split('/').map(encodeURIComponent).join('/');
+    return fetch(url).then(res => res.json());
+  }));
+
+  files.forEach((s, i) => {
+    // Loaded concurrently by another update
+    if (forensicsData.loadedSeries.has(paths[i])) {
+      return;
+    }
+    forensicsData.loadedSeries.add(paths[i]);
+    s.results.forEach(o => {
+      o.system = s.system;
+      o.config = s.config;
+      o.benchmark = s.benchmark;
+    });
+    prepareResults(s.results);
+    forensicsData.results.push(...s.results);
+    addResults(forensicsData, s.results);
+  });
+}
+
+/*
+ * Shards
+ */
+/* The sharded export lists its shards, and the deltas to apply to each, in
+   shards/manifest.json.  Shards are only rewritten when their deltas are
+   compacted, so the browser revalidates them and only downloads the new
+   deltas. */
+async function loadShards(manifest) {
+  var shards = await Promise.all(Object.values(manifest.shards).map(async entry => {
+    var paths = [entry.path].concat((entry.deltas || []).map(d => d.path));
+    var files = await Promise.all(paths.map(path =>
+      fetch('/results/shards/' + encodeURIComponent(path), { cache: 'no-cache' }).then(res => res.json())));
+    files = files.map(data => data.format === "compact" ? decodeCompact(data) : data);
+    return files.reduce(applyDelta);
+  }));
+
+  var data = { options: {}, results: [] };
+  shards.forEach(shard => {
+    mergeOptions(data.options, shard.options);
+    data.results = data.results.concat(shard.results);
+  });
+  return data;
+}
+
+/* See write_delta in export_json.py */
+function applyDelta(data, delta) {
+  var removed = new Set(delta.removed);
+  return {
+    options: delta.options,
+    results: data.results.filter(o => !removed.has(o.id)).concat(delta.results)
+  };
+}
+
+/* Shards by config each have the options of their config only */
+function mergeOptions(options, shardOptions) {
+  Object.keys(shardOptions).forEach(system => {
+    var o = shardOptions[system];
+    if (!options.hasOwnProperty(system)) {
+      options[system] = o;
+      return;
+    }
+    var merged = options[system];
+    Object.assign(merged.commitMessages, o.commitMessages);
+    Object.assign(merged.commitShas, o.commitShas);
+    // commitMessages has all the commits of the system, by timestamp
+    var commits = new Set(merged.commits.concat(o.commits));
+    merged.commits = Object.keys(merged.commitMessages).filter(c => commits.has(c));
+    merged.benchmarks = Array.from(new Set(merged.benchmarks.concat(o.benchmarks))).sort();
+    merged.configs = Array.from(new Set(merged.configs.concat(o.configs))).sort();
+  });
+}
+
+/* The export publishes content-hashed artifacts named by latest.json.  Those
+   can be cached forever, so only the small pointer is fetched each time. */
+async function resultsURL() {
+  try {
+    const res = await fetch('/results/latest.json', { cache: 'no-cache' });
+    if (res.status == 200) {
+      const pointer = await res.json();
+      return '/results/' + pointer.path;
+    }
+  } catch (err) {
+    console.log("No published artifacts - ", err);
+  }
+  return '/results/forensics.json';
+}
+
+async function start() {
+  try {
+    const res = await fetch('/results/series/index.json', { cache: 'no-cache' });
+    if (res.status == 200) {
+      var index = await res.json();
+    }
+  } catch (err) {
+    console.log("No series index - ", err);
+  }
+
+  if (index !== undefined) {
+    initSeries(index);
+    return;
+  }
+
+  try {
+    const res = await fetch('/results/shards/manifest.json', { cache: 'no-cache' });
+    if (res.status == 200) {
+      var data = await loadShards(await res.json());
+    }
+  } catch (err) {
+    console.log("No shards - ", err);
+  }
+
+  if (data !== undefined) {
+    prepareResults(data.results);
+    setup(data);
+  } else {
+    init(await resultsURL());
+  }
+}
+
+start();
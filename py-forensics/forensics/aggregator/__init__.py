@@ -1 +1,180 @@
-# TODO
+import os
+import hmac
+import json
+import zlib
+import threading
+import configparser
+
+from flask import Flask, Response, current_app, request
+from flask.views import MethodView
+
+from forensics import init_logger
+from forensics.models import upgrade_db
+from forensics.collector import parse
+from forensics.collector.loader import BulkLoader, new_batch
+
+# ==========================================
+# ============ INGEST SERVICE ==============
+# ==========================================
+
+# Largest accepted batch, once decompressed
+MAX_BATCH_SIZE = 256 * 1024 * 1024
+
+# One connection per process, see BulkLoader.load(shared=True)
+_loader = None
+_lock = threading.Lock()
+
+
+def decompress(data, encoding):
+    """Decompresses a gzip or deflate request body, refusing oversized batches."""
+
+    if encoding in ("", "identity"):
+        out = data
+    elif encoding in ("gzip", "deflate"):
+        d = zlib.decompressobj(zlib.MAX_WBITS | 32)  # Detects the header
+        out = d.decompress(data, MAX_BATCH_SIZE)
+        if d.unconsumed_tail:
+            raise ValueError("Batch too large")
+    else:
+        raise ValueError(f"Unsupported Content-Encoding {encoding}")
+
+    if len(out) > MAX_BATCH_SIZE:
+        raise ValueError("Batch too large")
+    return out
+
+
+def check_record(record, fields):
+    if not isinstance(record, dict) or not set(fields).issubset(record):
+        raise ValueError("Missing fields")
+    for f in fields:
+        expected = int if f in parse.INT_FIELDS else str
+        if not isinstance(record[f], expected):
+            raise ValueError(f"Bad value for {f}")
+
+
+def check_path(path):
+    if not isinstance(path, str) or not path:
+        raise ValueError("Bad path")
+
+
+def check_state(state):
+    if not (isinstance(state, list) and len(state) == 2 and all(isinstance(x, int) for x in state)):
+        raise ValueError("Bad file state")
+
+
+def read_batch(payload):
+    """Validates a pushed batch and returns it as a collector batch.
+
+    Paths are prefixed by the machine name, so that the results of different
+    machines never replace each other.
+    """
+
+    machine = payload.get("machine")
+    if not isinstance(machine, str) or not machine:
+        raise ValueError("Missing machine")
+
+    batch = new_batch()
+
+    for b in payload.get("builds", []):
+        check_path(b["path"])
+        check_state(b["state"])
+        check_record(b["data"], parse.BUILD_RESULTS_FIELDS)
+        batch["builds"].append({
+            "path": f"{machine}:{b['path']}",
+            "state": b["state"],
+            "hash": str(b["hash"]),
+            "data": b["data"],
+        })
+
+    for r in payload.get("runs", []):
+        for path in (r["path"], r["context_path"], r["build_path"]):
+            check_path(path)
+        if len(r["states"]) != 2 or len(r["hashes"]) != 2 or not isinstance(r["results"], list):
+            raise ValueError("Bad usage")
+        for state in r["states"]:
+            check_state(state)
+        check_record(r["context"], parse.RUN_CONTEXT_FIELDS)
+        for d in r["results"]:
+            check_record(d, parse.RUN_RESULTS_FIELDS)
+        batch["runs"].append({
+            "path": f"{machine}:{r['path']}",
+            "context_path": f"{machine}:{r['context_path']}",
+            "build_path": f"{machine}:{r['build_path']}",
+            "states": r["states"],
+            "hashes": [str(h) for h in r["hashes"]],
+            "context": r["context"],
+            "results": r["results"],
+        })
+
+    return batch
+
+
+def deduplicate(batch, loader):
+    """Drops the files of a batch whose content was already ingested."""
+
+    known = loader.known_hashes(
+        [b["path"] for b in batch["builds"]]
+        + [p for r in batch["runs"] for p in (r["path"], r["context_path"])]
+    )
+
+    batch["builds"] = [b for b in batch["builds"] if known.get(b["path"]) != b["hash"]]
+    batch["runs"] = [
+        r for r in batch["runs"]
+        if [known.get(r["path"]), known.get(r["context_path"])] != r["hashes"]
+    ]
+    return batch
+
+
+class APIIngest(MethodView):
+    def post(self):
+        global _loader
+
+        config = current_app.config["FORENSICS"]
+
+        token = config.get("AGGREGATOR", "token", fallback="")
+        authorization = request.headers.get("Authorization", "")
+        if token and not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            return Response("Unauthorized\n", status=401)
+
+        try:
+            body = decompress(request.get_data(), request.headers.get("Content-Encoding", ""))
+            batch = read_batch(json.loads(body))
+        except (ValueError, KeyError, TypeError, AttributeError, zlib.error) as e:
+            return Response(f"Bad batch: {str(e)}\n", status=400)
+
+        nbuilds, nruns = len(batch["builds"]), len(batch["runs"])
+
+        with _lock:
+            if _loader is None:
+                _loader = BulkLoader(config["SERVER"]["database"], check_same_thread=False)
+            batch = deduplicate(batch, _loader)
+            rejected = _loader.load(batch, shared=True)
+
+        result = {
+            "builds": len(batch["builds"]),
+            "runs": len(batch["runs"]) - len(rejected),
+            "duplicates": nbuilds + nruns - len(batch["builds"]) - len(batch["runs"]),
+            # Run results files whose build is unknown, without the machine prefix
+            "rejected": [path.split(":", 1)[1] for path in rejected],
+        }
+        return Response(json.dumps(result), mimetype="application/json")
+
+
+# App factory
+def create_app(config):
+
+    if isinstance(config, str):
+        _config = config
+        config = configparser.ConfigParser()
+        config.read(os.path.expanduser(_config))
+
+    init_logger(config)
+    upgrade_db(config)
+
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_BATCH_SIZE
+
+    app.config["FORENSICS"] = config
+    app.add_url_rule('/ingest', view_func=APIIngest.as_view('ingest'), methods=["POST",])
+
+    return app
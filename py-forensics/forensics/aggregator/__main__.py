@@ -0,0 +1,13 @@
+import argparse
+
+from forensics.aggregator import create_app
+
+parser = argparse.ArgumentParser(description="forensics aggregator")
+parser.add_argument("-c", "--conf", nargs=1, help="path to a forensics.conf file")
+
+args = parser.parse_args()
+
+app = create_app(args.conf[0])
+
+# Always run on debug when running as __main__
+app.run(debug=True, port=5001)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import json
+import gzip
+import logging
+import socket
+import sqlite3
+import argparse
+import configparser
+import urllib.request
+
+from forensics import init_logger
+from forensics.models import *
+from forensics.collector import scan
+from forensics.collector.loader import new_batch
+
+logger = logging.getLogger("forensics")
+
+# Number of changed builds and usage directories sent per request
+BATCH_SIZE = 200
+
+
+class PushState:
+    """Remembers the result files accepted by each aggregator."""
+
+    def __init__(self, path):
+        self.con = sqlite3.connect(path)
+        self.con.execute(
+            'CREATE TABLE IF NOT EXISTS "Pushed" ('
+            '"url" TEXT, "path" TEXT, "mtime" INTEGER, "size" INTEGER, "hash" TEXT, '
+            'PRIMARY KEY ("url", "path"))'
+        )
+
+    def manifest(self, url):
+        """Returns the files pushed to url, in the layout of the collector's ingest manifest."""
+
+        rows = self.con.execute('SELECT "path", "mtime", "size", "hash" FROM "Pushed" WHERE "url" = ?', (url,))
+        # The build id only needs to be set for scan.is_unchanged
+        return {path: (mtime, size, digest, 0, None) for path, mtime, size, digest in rows}
+
+    def record(self, url, batch, rejected=()):
+        """Remembers the files of batch accepted by url, all but the rejected run results files."""
+
+        rejected = set(rejected)
+        with self.con:
+            self.con.executemany(
+                'INSERT OR REPLACE INTO "Pushed" VALUES (?, ?, ?, ?, ?)',
+                [(url, b["path"], b["state"][0], b["state"][1], b["hash"]) for b in batch["builds"]]
+                + [
+                    (url, path, state[0], state[1], digest)
+                    for r in batch["runs"] if r["path"] not in rejected
+                    for path, state, digest in zip((r["path"], r["context_path"]), r["states"], r["hashes"])
+                ],
+            )
+            self.con.executemany(
+                'UPDATE "Pushed" SET "mtime" = ?, "size" = ? WHERE "url" = ? AND "path" = ?',
+                [(state[0], state[1], url, path) for path, state in batch["touched"]],
+            )
+
+    def close(self):
+        self.con.close()
+
+
+def send(url, batch, machine, token):
+    """Posts the builds and runs of a batch to an aggregator.
+
+    Returns the paths of the run results files it rejected.
+    """
+
+    if not batch["builds"] and not batch["runs"]:
+        return []
+
+    payload = {"machine": machine, "builds": batch["builds"], "runs": batch["runs"]}
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    request = urllib.request.Request(
+        url, data=gzip.compress(json.dumps(payload).encode()), headers=headers, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=600) as response:
+        result = json.load(response)
+
+    logger.info(
+        f"Pushed {len(batch['builds'])} builds and {len(batch['runs'])} usages to {url} "
+        f"({result['duplicates']} already known)"
+    )
+    for path in result["rejected"]:
+        # Pushed again next time
+        logger.warning(f"{url} rejected {path}, its build is unknown")
+
+    return result["rejected"]
+
+
+def push(url, systems, state, machine, token):
+    """Pushes the result files of a set of systems which changed since the last push to url."""
+
+    manifest = state.manifest(url)
+    batch = new_batch()
+
+    commits = [commit.path for system in systems for commit in ls_dir(system)]
+    for commit in commits:
+        commit_batch, _ = scan.scan_commit(commit, manifest)
+        for k in batch:
+            batch[k] += commit_batch[k]
+
+        if len(batch["builds"]) + len(batch["runs"]) >= BATCH_SIZE:
+            rejected = send(url, batch, machine, token)
+            state.record(url, batch, rejected)
+            batch = new_batch()
+
+    rejected = send(url, batch, machine, token)
+    state.record(url, batch, rejected)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pushes the results of a benchmark machine to forensics aggregators."
+    )
+    parser.add_argument("-c", "--conf", nargs=1, help="path to a forensics.conf file")
+    parser.add_argument("-s", "--state", required=True, help="path of the file remembering pushed results")
+    parser.add_argument("-u", "--url", nargs='+', required=True, help="ingest URLs of the aggregators")
+    parser.add_argument("-b", "--batch", nargs='+', required=True, help="path to system directory")
+    parser.add_argument("-m", "--machine", default=socket.gethostname(), help="name of this machine")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log to stdout")
+
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.conf)
+
+    init_logger(config, args.verbose)
+
+    token = config.get("AGGREGATOR", "token", fallback="")
+    systems = [os.path.abspath(d) for d in args.batch]
+
+    state = PushState(args.state)
+    status = 0
+    for url in args.url:
+        try:
+            push(url, systems, state, args.machine, token)
+        except Exception as e:
+            # The files which were not accepted are pushed again next time
+            logger.error(f"Could not push to {url} (Exception: {str(e)})")
+            status = 1
+    state.close()
+
+    exit(status)
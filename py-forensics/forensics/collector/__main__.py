@@ -1,13 +1,16 @@
 #
+import time
+import sqlite3
 import argparse
+import urllib.parse
 import configparser
-
-import random
-
-from numpy import nan
+import multiprocessing
 
 from forensics import init_logger
 from forensics.models import *
+from forensics.collector import scan, watch
+from forensics.collector.loader import BulkLoader, new_batch
+from forensics.collector.stats import merge_stats, report
 
 parser = argparse.ArgumentParser(
     description="benchd - The Gambit-forensics benchmarks daemon."
@@ -19,78 +22,125 @@ parser.add_argument(
     "-ba", "--batch-all", nargs='*', help="path to gambit-forensics build directory"
 )
 parser.add_argument("-v", "--verbose", action="store_true", help="log to stdout")
+parser.add_argument(
+    "-d", "--daemon", action="store_true",
+    help="after the batch insert, keep ingesting results as runs complete",
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="number of processes scanning and parsing result files"
+)
+parser.add_argument(
+    "-n", "--dry-run", action="store_true",
+    help="parse and validate the result files, but roll back instead of writing them",
+)
+parser.add_argument(
+    "-s", "--stats", action="store_true",
+    help="report throughput, time per phase and skipped directories after the batch insert",
+)
 
-args = parser.parse_args()
+# Number of changed builds and usage directories written per transaction
+BATCH_SIZE = 1000
 
-config = configparser.ConfigParser()
-config.read(args.conf)
 
-logger = init_logger(config, args.verbose)
+def batch_insert_dirs(systems, loader):
+    """Batch insert of results from a set of systems by recursively traversing the filesystem.
 
-def batch_insert_dirs(systems):
-    """Batch insert of results from a set of systems by recursively traversing the filesystem."""
+    Result files whose mtime and size match the ingest manifest are skipped, so
+    only builds and runs that changed since the previous pass are written. The
+    changed files are parsed into batches which are bulk-loaded in one
+    transaction each.
+
+    With --jobs N, commit directories are scanned and parsed by N worker
+    processes while this process remains the only writer to the database.
+
+    With --dry-run, each batch is rolled back instead of committed.
+
+    Batches are loaded with shared=True, as another collector, e.g. the
+    daemon or a cron pass, may be writing to the same database.
+    """
+
+    manifest = loader.manifest()
+    seen = set()
+    batch = new_batch()
+
+    commits = [commit.path for system in systems for commit in ls_dir(system)]
+
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(
+            args.jobs,
+            initializer=scan.init_worker,
+            initargs=(config, args.verbose, manifest),
+        )
+        scanned = pool.imap_unordered(scan.scan_commit_worker, commits, chunksize=4)
+    else:
+        pool = None
+        scanned = (scan.scan_commit_stats(commit, manifest) for commit in commits)
+
+    for commit_batch, commit_seen, commit_stats in scanned:
+        seen |= commit_seen
+        merge_stats(loader.stats, commit_stats)
+        for k in batch:
+            batch[k] += commit_batch[k]
+
+        if len(batch["builds"]) + len(batch["runs"]) >= BATCH_SIZE:
+            loader.load(batch, shared=True, dry_run=args.dry_run)
+            batch = new_batch()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    roots = tuple(os.path.abspath(s.path) + os.sep for s in systems)
+    batch["removed"] = removed_files(manifest, seen, roots)
+
+    loader.load(batch, shared=True, dry_run=args.dry_run)
 
-    for system in systems:
-        commits = ls_dir(system)
-        for commit in commits:
-            configs = ls_dir(commit)
-            for config in configs:
-                build_results = config.path + "/.forensics-build-results"
-                # Don't continue for failed builds.
-                # NOTE: Maybe save failed build state?
-                if not os.path.exists(build_results):
-                    logger.warning(
-                        f"Build results absent for {system.name}/{commit.name}/{config.name}"
-                    )
-                    break
-
-                try:
-                    build_id = insert_build_results(build_results)
-                except Exception as e:
-                    logger.warning(
-                            f"Could not process build for {system.name}/{commit.name}/{config.name}, skipping (Exception: {str(e)})"
-                    )
-                    break
-
-                logger.debug(
-                        f"Processed build for {system.name}/{commit.name}/{config.name} (id: {build_id})"
-                )
-
-                if not os.path.exists(config.path + "/.forensics-usage"):
-                    logger.warning(
-                        f"Usage directory absent for {system.name}/{commit.name}/{config.name}, skipping"
-                    )
-                    break
-
-                usages = ls_dir(config.path + "/.forensics-usage")
-                for usage in usages:
-                    run_results = usage.path + "/.forensics-run-results"
-                    if not os.path.exists(run_results):
-                        logger.warning(
-                            f"Run results absent for {system.name}/{commit.name}/{config.name}, skipping"
-                        )
-                        break
-
-                    run_context = usage.path + "/.forensics-run-context"
-                    if not os.path.exists(run_context):
-                        logger.warning(
-                            f"Run context absent for {system.name}/{commit.name}/{config.name}, skipping"
-                        )
-                        break
-
-                    try:
-                        insert_run_results(run_results, run_context, build_id)
-                    except Exception as e:
-                        logger.warning(
-                            f"Could not process run for {system.name}/{commit.name}/{config.name}/{usage.name}, skipping"
-                        )
-                        # Don't raise, continue
-
-                    logger.debug(
-                        f"Processed run for {system.name}/{commit.name}/{config.name}/{usage.name}"
-                    )
-
-def batch_insert(system_dirs):
+
+def removed_files(manifest, seen, roots):
+    """Returns the ingested files under the given roots which disappeared."""
+
+    return [
+        path for path in manifest
+        if path not in seen and path.startswith(roots) and not os.path.exists(path)
+    ]
+
+
+def insert_commits(commits, loader):
+    """Insert of the results of a set of commit directories."""
+
+    for commit in commits:
+        root = os.path.abspath(commit) + os.sep
+        manifest = loader.manifest(root)
+        batch, seen = scan.scan_commit(commit, manifest)
+        batch["removed"] = removed_files(manifest, seen, (root,))
+        loader.load(batch, shared=True)
+
+
+def daemon(roots, commit_depth, full_pass, loader):
+    """Ingests new results as soon as their run completes, until interrupted."""
+
+    logger.info(f"Watching {' , '.join(roots)}")
+
+    watcher = watch.Watcher(roots, commit_depth)
+    try:
+        while True:
+            commits = watcher.wait()
+            try:
+                if commits is None:
+                    full_pass()
+                else:
+                    logger.info(f"Runs completed in {' , '.join(sorted(commits))}")
+                    insert_commits(commits, loader)
+            except Exception as e:
+                # Keep watching, the next full pass retries
+                logger.error(f"Could not ingest results (Exception: {str(e)})")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def batch_insert(system_dirs, loader):
     """Batch insert of results from a set of systems by recursively traversing the filesystem."""
 
     logger.info(f"Proceeding with batch_insert in {' , '.join(system_dirs)}")
@@ -99,158 +149,72 @@ def batch_insert(system_dirs):
     for system_dir in system_dirs:
         systems += [d for d in os.scandir(os.path.dirname(system_dir) or '.') if d.name == os.path.basename(system_dir)]
 
-    batch_insert_dirs(systems)
+    batch_insert_dirs(systems, loader)
 
-def batch_insert_all(build_dirs):
+def batch_insert_all(build_dirs, loader):
     """Batch insert of results for all systems by recursively traversing the filesystem."""
 
     logger.info(f"Proceeding with batch_insert_all in {' , '.join(build_dirs)}")
 
     for build_dir in build_dirs:
         systems = ls_dir(build_dir)
-        batch_insert_dirs(systems)
-
-@db_session
-def insert_build_results(path):
-    """Inserts build results into the System, Commit, Config, Machine and Build tables."""
-
-    # TODO: Figure out why some cpython commits aren't properly parsed
-    df = pd.read_csv(path)
-    data = df.iloc[0].to_dict()
-
-    # Always check if entities already exist
-    system = System.get(name=data["system-name"])
-    if system is None:
-        system = System(
-            name=data["system-name"],
-            shortname=data["system-shortname"],
-            icon=data["system-icon"],
-            description=data["system-desc"],
-            setup=data["system-setup"],
-            url=data["system-url"],
-        )
-
-    commit = Commit.get(sha=data["commit-hash"], system=system)
-    if commit is None:
-        commit = Commit(
-            name=data["commit-name"],
-            sha=data["commit-hash"],
-            description=data["commit-desc"],
-            timestamp=datetime.fromtimestamp(int(data["commit-timestamp"])),
-            system=system,
-            url=data["commit-url"],
-            branch=data["commit-branch"]
-        )
-
-    config = Config.get(name=data["config-name"], system=system)
-    if config is None:
-        config = Config(
-            name=data["config-name"],
-            shortname=data["config-shortname"],
-            description=data["config-desc"],
-            setup=data["config-setup"],
-            system=system,
-        )
-
-    # NOTE: Maybe insert machine elsewhere
-    machine = Machine.get(name=data["machine-name"])
-    if machine is None:
-        machine = Machine(
-            name=data["machine-name"],
-            shortname=data["machine-shortname"],
-            description="change me",
-            setup=data["machine-setup"],
-            specs=data["machine-specs"],
-        )
-
-    build = Build.get(system=system, commit=commit, machine=machine, config=config)
-    if build is None:
-        build = Build(
-            timestamp=datetime.fromtimestamp(int(data["build-timestamp"])),
-            result=data["build-result"],
-            system=system,
-            commit=commit,
-            machine=machine,
-            config=config,
-        )
-
-        build.flush()
-
-    return build.id
-
-
-@db_session
-def insert_run_results(run_results, run_context, build_id):
-
-    build = Build[build_id]
-
-    # This should never trigger.
-    if build is None:
-        logger.critical("Build not found, skipping...")
-        return
-
-    # NOTE: Only get usage in the case of a bulk insert
-    ctx = pd.read_csv(run_context)
-    if ctx.empty:
-        raise Exception(f"Run context {run_context} is empty")
-
-    df = pd.read_csv(run_results)
-    if df.empty:
-        raise Exception(f"Run results {run_results} is empty")
-
-    for row in df.iloc:
-        data = row.to_dict()
-
-
-        # TODO: Properly fill usage information. Must emit in forensics.
-        usage = Usage.get(name=str(ctx["usage-name"][0]), system=build.system)
-        if usage is None:
-            usage = Usage(
-                name=str(ctx["usage-name"][0]),
-                shortname="change me",
-                description="change me",
-                setup=str(ctx["usage-setup"][0]),
-                system=build.system,
-            )
-
-        # TODO: Fill setup information and discriminate using
-        # setup+name pair.
-        benchmark = Benchmark.get(name=data["benchmark-name"])
-        if benchmark is None:
-            benchmark = Benchmark(
-                name=data["benchmark-name"],
-                shortname="change me",
-                description="change me",
-                setup="change me",
-            )
-
-        run = Run(
-            # NOTE: We choose the end of the computation as the timestamp.
-            timestamp=datetime.fromtimestamp(int(ctx["run-end-timestamp"][0])),
-            result=str(data["run-result"]),
-            build=build,
-            usage=usage,
-            benchmark=benchmark,
-        )
-
-if args.init:
-    init_db(config=config)
-    exit()
-
-db.bind(provider="sqlite", filename=config["SERVER"]["database"])
-db.generate_mapping(create_tables=False)
-
-# TODO
-# --batch system
-if args.batch:
-    print(f"Initiating batch_insert in {' , '.join(args.batch)}...")
-    batch_insert(args.batch)
-    print(f"Completed batch_insert in {' , '.join(args.batch)}.")
-    exit()
-
-# --batch-all
-if args.batch_all:
-    print(f"Initiating batch_insert_all in {' , '.join(args.batch_all)}...")
-    batch_insert_all(args.batch_all)
-    print(f"Completed batch_insert_all in {' , '.join(args.batch_all)}.")
-    exit()
+        batch_insert_dirs(systems, loader)
+
+# Guarded so that --jobs worker processes can import this module
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.conf)
+
+    logger = init_logger(config, args.verbose)
+
+    if args.init:
+        init_db(config=config)
+        exit()
+
+    if args.dry_run and args.daemon:
+        parser.error("--dry-run cannot be used with --daemon")
+
+    if args.dry_run:
+        # Nothing is written with --dry-run, not even a schema upgrade or an empty database
+        db_path = config["SERVER"]["database"]
+        if not has_schema(db_path):
+            parser.error(f"No forensics database at {db_path}, create it with --init")
+        con = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro", uri=True)
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        con.close()
+        if version != SCHEMA_VERSION:
+            parser.error("the database schema is out of date, upgrade it with --init before --dry-run")
+    else:
+        try:
+            upgrade_db(config)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+
+    loader = BulkLoader(config["SERVER"]["database"])
+
+    start = time.perf_counter()
+
+    # TODO
+    # --batch system
+    if args.batch:
+        print(f"Initiating batch_insert in {' , '.join(args.batch)}...")
+        batch_insert(args.batch, loader)
+        print(f"Completed batch_insert in {' , '.join(args.batch)}.")
+        if args.stats:
+            print(report(loader.stats, time.perf_counter() - start))
+        if args.daemon:
+            daemon(args.batch, 1, lambda: batch_insert(args.batch, loader), loader)
+        exit()
+
+    # --batch-all
+    if args.batch_all:
+        print(f"Initiating batch_insert_all in {' , '.join(args.batch_all)}...")
+        batch_insert_all(args.batch_all, loader)
+        print(f"Completed batch_insert_all in {' , '.join(args.batch_all)}.")
+        if args.stats:
+            print(report(loader.stats, time.perf_counter() - start))
+        if args.daemon:
+            daemon(args.batch_all, 2, lambda: batch_insert_all(args.batch_all, loader), loader)
+        exit()
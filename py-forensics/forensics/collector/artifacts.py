@@ -0,0 +1,172 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("forensics")
+
+# Name of the published files in an artifacts directory, before the hash
+ARTIFACT_STEM = "forensics"
+
+# Names of the published files and of their compressed variants, which do not
+# include the export they are copied from, e.g. forensics.json
+ARTIFACT_NAME = re.compile(re.escape(ARTIFACT_STEM) + r"\.[0-9a-f]{16}\.[a-z]+(\.gz|\.br)?")
+
+# Pointer to the latest artifacts, the only file of the directory whose name is stable
+POINTER = "latest.json"
+
+# Number of published versions kept, so that clients which read the previous
+# pointer can still fetch its artifacts
+KEEP = 3
+
+# Only the exports whose contents changed are compressed, so the slow but
+# smallest setting is affordable
+BROTLI_QUALITY = 11
+
+
+def write_atomic(path, write, mode="w"):
+    """Calls write with a temporary file, then renames it over path.
+
+    Readers of path see either the previous or the new file, never a partial
+    one. Returns the result of write.
+    """
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            result = write(f)
+
+        # mkstemp creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return result
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_gzip(src, dst):
+    def write(f):
+        # mtime=0 so that the same contents always compress to the same bytes
+        with open(src, "rb") as i, gzip.GzipFile(fileobj=f, mode="wb", compresslevel=9, mtime=0) as o:
+            shutil.copyfileobj(i, o, 1 << 20)
+
+    write_atomic(dst, write, "wb")
+
+
+def write_brotli(src, dst):
+    def write(f):
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        with open(src, "rb") as i:
+            for chunk in iter(lambda: i.read(1 << 20), b""):
+                f.write(compressor.process(chunk))
+        f.write(compressor.finish())
+
+    write_atomic(dst, write, "wb")
+
+
+def compress(path):
+    """Writes the gzip and, when the brotli module is installed, brotli variants of path.
+
+    They are named path.gz and path.br, as served by nginx's gzip_static and
+    brotli_static. Returns the names of the files written.
+    """
+
+    write_gzip(path, path + ".gz")
+    written = [os.path.basename(path) + ".gz"]
+
+    if brotli is not None:
+        write_brotli(path, path + ".br")
+        written.append(os.path.basename(path) + ".br")
+
+    return written
+
+
+def read_pointer(directory):
+    try:
+        with open(os.path.join(directory, POINTER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def publish(path, directory):
+    """Copies path to directory under a content-hashed name, with compressed variants.
+
+    The pointer file names the latest artifacts. It is only rewritten when the
+    contents of path changed, so that publishing can be skipped when it did
+    not. Returns the pointer.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    digest = file_hash(path)
+    pointer = read_pointer(directory)
+    if pointer.get("hash") == digest and os.path.exists(os.path.join(directory, pointer["path"])):
+        return pointer
+
+    name = f"{ARTIFACT_STEM}.{digest[:16]}{os.path.splitext(path)[1]}"
+    artifact = os.path.join(directory, name)
+
+    previous = [pointer["path"]] if "path" in pointer else []
+    previous += pointer.get("previous", [])
+    # The contents may go back to those of a version which is still kept
+    previous = [p for p in dict.fromkeys(previous) if p != name][:KEEP - 1]
+
+    def copy(f):
+        with open(path, "rb") as i:
+            shutil.copyfileobj(i, f, 1 << 20)
+
+    write_atomic(artifact, copy, "wb")
+    variants = compress(artifact)
+
+    pointer = {
+        "hash": digest,
+        "path": name,
+        "gzip": name + ".gz",
+        "brotli": name + ".br" if name + ".br" in variants else None,
+        "size": os.path.getsize(artifact),
+        "modified": int(time.time() * 1000),
+        "previous": previous,
+    }
+    write_atomic(os.path.join(directory, POINTER), lambda f: json.dump(pointer, f, indent=2))
+
+    prune(directory, [pointer["path"]] + pointer["previous"])
+    logger.info(f"Published {name} ({', '.join(variants)})")
+
+    return pointer
+
+
+def prune(directory, kept):
+    """Removes the artifacts of the versions which are not kept."""
+
+    kept = set(kept)
+    for entry in os.scandir(directory):
+        match = ARTIFACT_NAME.fullmatch(entry.name)
+        if match is None:
+            continue
+        base = entry.name[:match.start(1)] if match.group(1) else entry.name
+        if base not in kept:
+            os.unlink(entry.path)
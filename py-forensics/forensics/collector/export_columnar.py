@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import argparse
+import configparser
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from forensics import init_logger
+from forensics.collector.artifacts import write_atomic
+from forensics.collector.export_json import js_timestamp
+
+parser = argparse.ArgumentParser(
+    description="Exports every sample of the database as an Arrow or Parquet table, for offline analysis."
+)
+parser.add_argument("-c", "--conf", nargs=1, help="path to a benchd.conf file")
+parser.add_argument(
+    "-o", "--output", help="path of the table, by default the json file of the configuration with another extension"
+)
+parser.add_argument(
+    "--format", choices=("arrow", "parquet"), default="arrow",
+    help="Arrow IPC file, which can be memory-mapped, or compressed Parquet",
+)
+
+# Number of rows of each record batch (or Parquet row group)
+BATCH_SIZE = 65536
+
+# Names of the rows referenced by Build and Run, whose columns are
+# dictionary-encoded with these names as dictionaries
+DIMENSIONS = {
+    "system": 'SELECT "id", "name" FROM "System" ORDER BY "id"',
+    "config": 'SELECT "id", "name" FROM "Config" ORDER BY "id"',
+    "commit": 'SELECT "id", "name" FROM "Commit" ORDER BY "id"',
+    "machine": 'SELECT "id", "name" FROM "Machine" ORDER BY "id"',
+    "usage": 'SELECT "id", "name" FROM "Usage" ORDER BY "id"',
+    "benchmark": 'SELECT "id", "name" FROM "Benchmark" ORDER BY "id"',
+}
+
+COMMITS = 'SELECT "id", "timestamp", "branch" FROM "Commit" ORDER BY "id"'
+
+STATUSES = 'SELECT DISTINCT "status" FROM "Run" ORDER BY "status"'
+
+# One row per sample, or a single row with a NULL value for runs without samples
+SAMPLES = '''
+SELECT "Build"."system", "Build"."config", "Build"."commit", "Build"."machine", "Run"."usage", "Run"."benchmark",
+  "Run"."id", "Run"."status", "Sample"."iteration", "Sample"."value"
+FROM "Run"
+JOIN "Build" ON "Build"."id" = "Run"."build"
+LEFT JOIN "Sample" ON "Sample"."run" = "Run"."id"
+ORDER BY "Run"."id", "Sample"."iteration"
+'''
+
+
+def dictionary_type():
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def table_schema():
+    return pa.schema([
+        ("system", dictionary_type()),
+        ("config", dictionary_type()),
+        ("commit", dictionary_type()),
+        ("timestamp", pa.timestamp("ms")),
+        ("branch", dictionary_type()),
+        ("machine", dictionary_type()),
+        ("usage", dictionary_type()),
+        ("benchmark", dictionary_type()),
+        ("run", pa.int64()),
+        ("status", dictionary_type()),
+        ("iteration", pa.int32()),
+        ("sample", pa.float64()),
+    ])
+
+
+class Dimension:
+    """Maps the ids of a table to the indices of its names in a dictionary."""
+
+    def __init__(self, ids, names):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.positions = np.full(int(ids.max(initial=0)) + 1, -1, dtype=np.int32)
+        self.positions[ids] = np.arange(len(ids), dtype=np.int32)
+        self.dictionary = pa.array(names, pa.string())
+
+    def encode(self, ids):
+        indices = self.positions[np.asarray(ids, dtype=np.int64)]
+        return pa.DictionaryArray.from_arrays(pa.array(indices), self.dictionary)
+
+
+def read_dimensions(con):
+    dimensions = {}
+    for name, query in DIMENSIONS.items():
+        rows = con.execute(query).fetchall()
+        dimensions[name] = Dimension([i for i, _ in rows], [n for _, n in rows])
+    return dimensions
+
+
+def read_commits(con):
+    """Returns the timestamps (in ms) and branch dictionary of the commits, indexed by id."""
+
+    rows = con.execute(COMMITS).fetchall()
+    size = max((i for i, _, _ in rows), default=0) + 1
+
+    branches = {}
+    timestamps = np.zeros(size, dtype=np.int64)
+    branch = np.full(size, -1, dtype=np.int32)
+    for i, timestamp, name in rows:
+        timestamps[i] = js_timestamp(timestamp)
+        branch[i] = branches.setdefault(name, len(branches))
+
+    return timestamps, branch, pa.array(list(branches), pa.string())
+
+
+def record_batches(con, schema):
+    """Yields the samples of all runs, BATCH_SIZE rows at a time."""
+
+    dimensions = read_dimensions(con)
+    timestamps, branch, branches = read_commits(con)
+    statuses = [s for s, in con.execute(STATUSES)]
+    status_index = {s: i for i, s in enumerate(statuses)}
+    statuses = pa.array(statuses, pa.string())
+
+    cursor = con.execute(SAMPLES)
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+
+        system, config, commit, machine, usage, benchmark, run, status, iteration, value = zip(*rows)
+        commit_ids = np.asarray(commit, dtype=np.int64)
+
+        yield pa.RecordBatch.from_arrays([
+            dimensions["system"].encode(system),
+            dimensions["config"].encode(config),
+            dimensions["commit"].encode(commit_ids),
+            pa.array(timestamps[commit_ids], pa.timestamp("ms")),
+            pa.DictionaryArray.from_arrays(pa.array(branch[commit_ids]), branches),
+            dimensions["machine"].encode(machine),
+            dimensions["usage"].encode(usage),
+            dimensions["benchmark"].encode(benchmark),
+            pa.array(run, pa.int64()),
+            pa.DictionaryArray.from_arrays(pa.array([status_index[s] for s in status], pa.int32()), statuses),
+            # Runs without samples have a single row with null iteration and sample
+            pa.array(iteration, pa.int32()),
+            pa.array(value, pa.float64()),
+        ], schema=schema)
+
+
+def write_arrow(f, con):
+    """Writes the samples as an Arrow IPC file. Returns the number of rows."""
+
+    schema = table_schema()
+    n = 0
+    with pa.ipc.new_file(f, schema) as writer:
+        for batch in record_batches(con, schema):
+            writer.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+
+def write_parquet(f, con):
+    """Writes the samples as a Parquet file. Returns the number of rows."""
+
+    schema = table_schema()
+    n = 0
+    with pq.ParquetWriter(f, schema, compression="zstd") as writer:
+        for batch in record_batches(con, schema):
+            writer.write_batch(batch)
+            n += batch.num_rows
+    return n
+
+
+# Writers and file extensions of the --format choices
+FORMATS = {"arrow": (write_arrow, ".arrow"), "parquet": (write_parquet, ".parquet")}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if pa is None:
+        parser.error("pyarrow is required for the columnar export")
+
+    config = configparser.ConfigParser()
+    config.read(args.conf)
+
+    logger = init_logger(config)
+
+    write, extension = FORMATS[args.format]
+    path = args.output or os.path.splitext(config["SERVER"]["json"])[0] + extension
+
+    con = sqlite3.connect(config["SERVER"]["database"])
+    n = write_atomic(path, lambda f: write(f, con), "wb")
+    con.close()
+
+    logger.info(f"export_columnar.py ### Wrote {path} ({n} samples)")
@@ -1,79 +1,750 @@
 #!/usr/bin/env python3
 
+import os
 import json
+import math
+import time
+import shutil
+import sqlite3
 import argparse
+import tempfile
+import itertools
+import multiprocessing
 import configparser
+import urllib.parse
+from array import array
+from datetime import datetime
 
-from forensics import init_logger
-from forensics.models import *
+import numpy as np
 
-# Provide very succinct debug information in the logs
-debug = False
+from forensics import init_logger
+from forensics.collector.artifacts import file_hash, publish, write_atomic
+from forensics.collector.summary import STATISTICS, with_statistics
 
 parser = argparse.ArgumentParser(
     description="benchd - The Gambit-forensics benchmarks daemon."
 )
 parser.add_argument("-c", "--conf", nargs=1, help="path to a benchd.conf file")
+parser.add_argument(
+    "-s", "--shards", help="write one file per shard and a manifest.json to this directory, instead of the json file"
+)
+parser.add_argument(
+    "--shard-by", choices=("system", "config"), default="system", help="split the results by system or by (system, config)"
+)
+parser.add_argument("-f", "--force", action="store_true", help="regenerate all the shards")
+parser.add_argument(
+    "-d", "--delta", action="store_true",
+    help="write the runs added or replaced since the previous export of a shard to a delta file, instead of the whole shard",
+)
+parser.add_argument("--compact", action="store_true", help="fold the delta files back into their shards")
+parser.add_argument(
+    "--series", help="also write a file per (system, config, benchmark) series and an index.json to this directory"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="number of processes exporting the systems, or the shards, in parallel"
+)
+parser.add_argument(
+    "-a", "--artifacts",
+    help="also publish the json file to this directory, under a content-hashed name with gzip and brotli variants",
+)
+parser.add_argument(
+    "--format", choices=("json", "compact"), default="json",
+    help="layout of the results: one object per run, or dictionary-encoded columns",
+)
+
+# Version of the manifest.json layout
+MANIFEST_VERSION = 2
+
+# Version of the compact layout, see write_compact
+COMPACT_VERSION = 3
+
+# Version of the delta header, see write_delta
+DELTA_VERSION = 2
+
+# Version of the series index, see export_series
+SERIES_VERSION = 1
+
+# Number of delta files of a shard after which it is compacted
+MAX_DELTAS = 8
+
+# Systems which actually have a run
+SYSTEMS = '''
+SELECT "System"."id", "System"."name" FROM "System"
+WHERE EXISTS (
+  SELECT 1 FROM "Build" JOIN "Run" ON "Run"."build" = "Build"."id"
+  WHERE "Build"."system" = "System"."id"
+)
+ORDER BY "System"."name"
+'''
+
+# Configs of a system which actually have a run
+SYSTEM_CONFIGS = '''
+SELECT DISTINCT "Config"."id", "Config"."name" FROM "Build"
+JOIN "Config" ON "Config"."id" = "Build"."config"
+WHERE "Build"."system" = ? AND EXISTS (SELECT 1 FROM "Run" WHERE "Run"."build" = "Build"."id")
+ORDER BY "Config"."name"
+'''
+
+# The queries below are restricted to the builds of a config when :config is not NULL
+
+COMMITS = '''
+SELECT "Commit"."name", "Commit"."sha", "Commit"."description", "Commit"."timestamp",
+  EXISTS (
+    SELECT 1 FROM "Build" JOIN "Run" ON "Run"."build" = "Build"."id"
+    WHERE "Build"."commit" = "Commit"."id" AND (:config IS NULL OR "Build"."config" = :config)
+  )
+FROM "Commit" WHERE "Commit"."system" = :system
+ORDER BY "Commit"."timestamp"
+'''
+
+BENCHMARKS = '''
+SELECT DISTINCT "Benchmark"."name" FROM "Run"
+JOIN "Build" ON "Build"."id" = "Run"."build"
+JOIN "Benchmark" ON "Benchmark"."id" = "Run"."benchmark"
+WHERE "Build"."system" = :system AND (:config IS NULL OR "Build"."config" = :config)
+ORDER BY "Benchmark"."name"
+'''
+
+CONFIGS = '''
+SELECT DISTINCT "Config"."name" FROM "Build"
+JOIN "Config" ON "Config"."id" = "Build"."config"
+WHERE "Build"."system" = :system AND (:config IS NULL OR "Build"."config" = :config)
+  AND EXISTS (SELECT 1 FROM "Run" WHERE "Run"."build" = "Build"."id")
+ORDER BY "Config"."name"
+'''
+
+# Run ids only grow (AUTOINCREMENT) and replaced runs get new ids, so the
+# results of a shard are unchanged as long as these are
+FINGERPRINT = '''
+SELECT
+  (SELECT count(*) FROM "Commit" WHERE "system" = :system),
+  (SELECT max("id") FROM "Commit" WHERE "system" = :system),
+  count("Run"."id"),
+  max("Run"."id")
+FROM "Build" JOIN "Run" ON "Run"."build" = "Build"."id"
+WHERE "Build"."system" = :system AND (:config IS NULL OR "Build"."config" = :config)
+'''
+
+# Ids of the runs of a shard, recorded so that the next delta can list the removed ones
+RUN_IDS = '''
+SELECT "Run"."id" FROM "Build" JOIN "Run" ON "Run"."build" = "Build"."id"
+WHERE "Build"."system" = :system AND (:config IS NULL OR "Build"."config" = :config)
+ORDER BY "Run"."id"
+'''
+
+# One row per sample, or a single row with a NULL value for runs without
+# samples. Only the runs whose id is greater than :since are selected.
+SELECT_RESULTS = '''
+SELECT "Run"."id", "Benchmark"."name", "Commit"."name", "Commit"."timestamp", "Config"."name", "Run"."status",
+  "Sample"."value"
+FROM "Run"
+JOIN "Build" ON "Build"."id" = "Run"."build"
+JOIN "Commit" ON "Commit"."id" = "Build"."commit"
+JOIN "Config" ON "Config"."id" = "Build"."config"
+JOIN "Benchmark" ON "Benchmark"."id" = "Run"."benchmark"
+LEFT JOIN "Sample" ON "Sample"."run" = "Run"."id"
+WHERE "Build"."system" = :system AND (:config IS NULL OR "Build"."config" = :config) AND "Run"."id" > :since
+'''
+
+# Ordered by run, so that the rows of a run are adjacent
+RESULTS = SELECT_RESULTS + 'ORDER BY "Run"."id", "Sample"."iteration"'
+
+# Ordered by series, then by commit timestamp, see export_series
+SERIES = SELECT_RESULTS + 'ORDER BY "Config"."name", "Benchmark"."name", "Commit"."timestamp", "Run"."id", "Sample"."iteration"'
+
+
+def js_timestamp(timestamp):
+    """Converts a datetime stored by PonyORM to milliseconds since the epoch."""
+
+    return datetime.fromisoformat(timestamp).timestamp() * 1000
+
+
+def system_options(con, system, config=None):
+    """Returns the options of a system: its commits, benchmarks and configs."""
+
+    params = {"system": system, "config": config}
+    commits = con.execute(COMMITS, params).fetchall()
+
+    return {
+        "commitMessages": {name: description for name, sha, description, timestamp, has_runs in commits},
+        "commitShas": {name: sha for name, sha, description, timestamp, has_runs in commits},
+        "benchmarks": [name for name, in con.execute(BENCHMARKS, params)],
+        "commits": [name for name, sha, description, timestamp, has_runs in commits if has_runs],
+        "configs": [name for name, in con.execute(CONFIGS, params)],
+    }
+
+
+def system_results(con, system, system_name, config=None, since=0):
+    """Yields the results of the runs of a system, streamed from a single query.
+
+    Only the runs whose id is greater than since are included. The statistics
+    of the samples are added by summary.with_statistics.
+    """
+
+    return with_statistics(run_results(con, system, system_name, config, since))
+
+
+def run_results(con, system, system_name, config, since, query=RESULTS):
+    timestamps = {}
+    rows = con.execute(query, {"system": system, "config": config, "since": since})
+    for _, run_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        run_rows = list(run_rows)
+        run, benchmark, commit, timestamp, config, status, _ = run_rows[0]
 
-args = parser.parse_args()
+        if timestamp not in timestamps:
+            timestamps[timestamp] = js_timestamp(timestamp)
 
-config = configparser.ConfigParser()
-config.read(args.conf)
+        yield {
+            # Replaced runs get a new id, see write_delta
+            "id": run,
+            "system": system_name,
+            "benchmark": benchmark,
+            "commit": commit,
+            "timestamp": timestamps[timestamp],
+            # Crashed runs have no samples
+            "values": [row[6] for row in run_rows if row[6] is not None],
+            "config": config,
+            "status": status,
+        }
 
-logger = init_logger(config)
 
-db.bind(provider="sqlite", filename=config["SERVER"]["database"])
-db.generate_mapping(create_tables=False)
+def export(con):
+    """Returns the options of all systems, and an iterator over their results."""
 
-# Automatically created non-existing keys in dicts
-output = {
-    "options": dict(),
-    "results": []
+    systems = con.execute(SYSTEMS).fetchall()
+
+    # Each system is a root
+    options = {name: system_options(con, system) for system, name in systems}
+    results = itertools.chain.from_iterable(system_results(con, system, name) for system, name in systems)
+
+    return options, results
+
+
+def write_json(f, options, results, header=None):
+    """Writes forensics.json, one result at a time. Returns the number of results.
+
+    The fields of header, if any, are written before the options.
+    """
+
+    begin_json(f, options, header)
+    n = write_json_results(f, results)
+    f.write(JSON_END)
+    return n
+
+
+def begin_json(f, options, header=None):
+    f.write("{")
+    for key, value in (header or {}).items():
+        f.write(f"\n  {json.dumps(key)}: {json.dumps(value)},")
+    f.write('\n  "options": ')
+    f.write(json.dumps(options, indent=2).replace("\n", "\n  "))
+    f.write(',\n  "results": [')
+
+
+def write_json_results(f, results):
+    n = 0
+    for r in results:
+        f.write(",\n    " if n else "\n    ")
+        f.write(json.dumps(r))
+        n += 1
+    return n
+
+
+JSON_END = "\n  ]\n}\n"
+
+
+def write_array(f, a):
+    """Writes an array of numbers as a JSON array, a chunk at a time. NaN is written as null."""
+
+    f.write("[")
+    for i in range(0, len(a), 65536):
+        if i:
+            f.write(",")
+        # No other repr of an int or float contains "nan"
+        f.write(",".join(map(repr, a[i:i + 65536])).replace("nan", "null"))
+    f.write("]")
+
+
+def write_compact(f, options, results):
+    """Writes the results dictionary-encoded. Returns the number of results.
+
+    For each system, "results" holds string tables (commits, with their
+    timestamps, benchmarks, configs and statuses) and one column per field:
+    the id of each run, its commit, benchmark, config and status indices, its
+    statistics (null without samples), its number of values, and all the values one run after the
+    other.
+
+        {"format": "compact", "version": 3, "options": {...},
+         "results": {system: {"commits": [...], "timestamps": [...],
+                              "benchmarks": [...], "configs": [...], "statuses": [...],
+                              "id": [...], "commit": [...], "benchmark": [...], "config": [...],
+                              "status": [...], "min": [...], "max": [...],
+                              "mean": [...], "median": [...], "stddev": [...],
+                              "count": [...], "values": [...]}}}
+    """
+
+    begin_compact(f, options)
+    n = write_compact_results(f, results)
+    f.write(COMPACT_END)
+    return n
+
+
+def begin_compact(f, options, header=None):
+    f.write(f'{{"format": "compact", "version": {COMPACT_VERSION},')
+    for key, value in (header or {}).items():
+        f.write(f"\n {json.dumps(key)}: {json.dumps(value)},")
+    f.write('\n "options": ')
+    json.dump(options, f)
+    f.write(',\n "results": {')
+
+
+def write_compact_results(f, results):
+    """Writes the tables of the systems of results, separated by commas."""
+
+    tables = {}
+    n = 0
+    for r in results:
+        if r["system"] not in tables:
+            tables[r["system"]] = {
+                "strings": {"commits": {}, "benchmarks": {}, "configs": {}, "statuses": {}},
+                "timestamps": array("q"),
+                "id": array("q"),
+                "commit": array("l"), "benchmark": array("l"), "config": array("l"), "status": array("l"),
+                "count": array("l"),
+                "values": array("d"),
+            }
+            for statistic in STATISTICS:
+                tables[r["system"]][statistic] = array("d")
+        t = tables[r["system"]]
+
+        t["id"].append(r["id"])
+        commits = t["strings"]["commits"]
+        if r["commit"] not in commits:
+            commits[r["commit"]] = len(commits)
+            t["timestamps"].append(int(r["timestamp"]))
+        t["commit"].append(commits[r["commit"]])
+
+        for field, table in (("benchmark", "benchmarks"), ("config", "configs"), ("status", "statuses")):
+            strings = t["strings"][table]
+            t[field].append(strings.setdefault(r[field], len(strings)))
+
+        for statistic in STATISTICS:
+            t[statistic].append(math.nan if r[statistic] is None else r[statistic])
+
+        t["count"].append(len(r["values"]))
+        t["values"].extend(r["values"])
+        n += 1
+
+    for i, (system, t) in enumerate(tables.items()):
+        f.write(("," if i else "") + f"\n  {json.dumps(system)}: {{")
+        for table, strings in t["strings"].items():
+            f.write(f"\n   {json.dumps(table)}: {json.dumps(list(strings))},")
+        f.write('\n   "timestamps": ')
+        write_array(f, t["timestamps"])
+        for column in ("id", "commit", "benchmark", "config", "status") + STATISTICS + ("count", "values"):
+            f.write(f',\n   "{column}": ')
+            write_array(f, t[column])
+        f.write("\n  }")
+
+    return n
+
+
+COMPACT_END = "\n }\n}\n"
+
+# Writers of the --format choices
+FORMATS = {"json": write_json, "compact": write_compact}
+
+# The same, in pieces: the beginning, with the options, the results, and the
+# end. With --jobs, the results of each system are written by a worker process
+# and joined with commas.
+LAYOUTS = {
+    "json": (begin_json, write_json_results, JSON_END),
+    "compact": (begin_compact, write_compact_results, COMPACT_END),
 }
-options = output["options"]
 
-with db_session():
-    # Select systems which actually have a run.
-    # Distinct by default in PonyORM
-    systems = select(s for s in System for b in Build for r in Run if b == r.build and s == b.system)[:]
 
-    # Build the options dictionary
-    for system in systems:
-        # Each system is a root
-        options[system.name] = dict()
-        # Re-use query
-        _builds = select(b for b in Build for r in Run if b.system == system and b == r.build)
-        if debug: logger.info(f"export_json.py ### processing {len(_builds)} builds")
+def shards(con, by):
+    """Returns {name: (system id, system name, config id, config name)} of the shards.
+
+    The config is None when sharding by system.
+    """
+
+    result = {}
+    for system, system_name in con.execute(SYSTEMS).fetchall():
+        if by == "system":
+            result[urllib.parse.quote(system_name, safe="")] = (system, system_name, None, None)
+            continue
+        for config, config_name in con.execute(SYSTEM_CONFIGS, (system,)).fetchall():
+            name = urllib.parse.quote(system_name, safe="") + "." + urllib.parse.quote(config_name, safe="")
+            result[name] = (system, system_name, config, config_name)
+    return result
+
+
+def write_delta(f, fmt, header, options, results):
+    """Writes the runs of a shard added or replaced since its previous export.
+
+    The layout is the fmt one of the shard, with the export generations it
+    goes from and to, and the ids of the runs removed in between, before the
+    options:
+
+        {"delta": 2, "since": 12, "generation": 13, "removed": [...],
+         "options": {...}, "results": [...]}
+
+    Replaced runs get a new id, so they are both removed and in the results.
+    To apply a delta, drop the removed runs, append the results and replace
+    the options, as done by applyDelta in the client. Returns the number of
+    results.
+    """
+
+    begin, write_results, end = LAYOUTS[fmt]
+    begin(f, options, dict(delta=DELTA_VERSION, **header))
+    n = write_results(f, results)
+    f.write(end)
+    return n
+
+
+def shard_files(name, entry):
+    """Returns the files of a shard in the manifest, including its run ids."""
+
+    return [entry["path"], f".{name}.runs"] + [d["path"] for d in entry.get("deltas", [])]
+
+
+def export_shard(con, directory, name, shard, entry, generation, fmt="json", force=False, delta=False, compact=False):
+    """Exports a shard whose previous manifest entry is entry, if any.
+
+    See export_shards. Returns the new manifest entry and the name of the
+    file written, or None if the shard did not change.
+    """
+
+    system, system_name, config, config_name = shard
+    path = os.path.join(directory, name + ".json")
+    runs_path = os.path.join(directory, f".{name}.runs")
+    params = {"system": system, "config": config}
+
+    # A single read transaction, so that the runs of the shard match its fingerprint
+    con.execute("BEGIN")
+    try:
+        fingerprint = list(con.execute(FINGERPRINT, params).fetchone())
+
+        valid = entry is not None and os.path.exists(path) and file_hash(path) == entry["hash"]
+        if (not force and valid and entry["fingerprint"] == fingerprint
+                and not (compact and entry["deltas"])):
+            return entry, None
+
+        options = {system_name: system_options(con, system, config)}
+        ids = np.array([i for i, in con.execute(RUN_IDS, params)], dtype=np.int64)
+
+        if (delta and not force and not compact and valid and len(entry["deltas"]) < MAX_DELTAS
+                and os.path.exists(runs_path)):
+            header = {
+                "since": entry["generation"],
+                "generation": generation,
+                "removed": np.setdiff1d(np.fromfile(runs_path, dtype=np.int64), ids).tolist(),
+            }
+            written = f"{name}.delta-{generation}.json"
+            delta_path = os.path.join(directory, written)
+            results = system_results(con, system, system_name, config, since=entry["lastRun"])
+            runs = write_atomic(delta_path, lambda f: write_delta(f, fmt, header, options, results))
+
+            entry = dict(entry, fingerprint=fingerprint, generation=generation, lastRun=int(ids.max(initial=0)))
+            entry["deltas"] = entry["deltas"] + [{
+                "path": written,
+                "since": header["since"],
+                "generation": generation,
+                "runs": runs,
+                "removed": len(header["removed"]),
+                "hash": file_hash(delta_path),
+                "modified": int(time.time() * 1000),
+            }]
+        else:
+            written = name + ".json"
+            results = system_results(con, system, system_name, config)
+            runs = write_atomic(path, lambda f: FORMATS[fmt](f, options, results))
+
+            entry = {
+                "path": written,
+                "system": system_name,
+                "config": config_name,
+                "runs": runs,
+                "hash": file_hash(path),
+                "modified": int(time.time() * 1000),
+                "fingerprint": fingerprint,
+                "generation": generation,
+                # The next delta has the runs after this one
+                "lastRun": int(ids.max(initial=0)),
+                "deltas": [],
+            }
+    finally:
+        con.rollback()
+
+    write_atomic(runs_path, lambda f: f.write(ids.tobytes()), "wb")
+    return entry, written
+
+
+def export_shards(con, directory, by, fmt="json", force=False, delta=False, compact=False, jobs=1):
+    """Writes one file per shard and a manifest.json listing them to directory.
+
+    Shards whose commits and runs did not change since the last export, as
+    recorded in the manifest, are kept as they are. With delta, the changes
+    of the others are appended to their manifest entry as delta files (see
+    write_delta), unless compact is given or a shard already has MAX_DELTAS
+    of them, which regenerates it. Each export which writes a file increments
+    the generation of the manifest. With jobs > 1, the shards are exported by
+    that many worker processes. Returns the names of the files written.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+    # Shards of another layout are all regenerated, but still cleaned up
+    stale = {path for name, entry in previous.get("shards", {}).items() for path in shard_files(name, entry)}
+    generation = previous.get("generation", 0) + 1
+    if (previous.get("version") != MANIFEST_VERSION or previous.get("shardBy") != by
+            or previous.get("format", "json") != fmt):
+        previous = {}
+    previous = previous.get("shards", {})
+
+    tasks = [
+        (directory, name, shard, previous.get(name), generation, fmt, force, delta, compact)
+        for name, shard in shards(con, by).items()
+    ]
+    if jobs > 1:
+        with worker_pool(con, jobs) as pool:
+            exported = pool.starmap(export_shard_worker, tasks, chunksize=1)
+    else:
+        exported = [export_shard(con, *task) for task in tasks]
+
+    manifest = {"version": MANIFEST_VERSION, "shardBy": by, "format": fmt, "generation": generation, "shards": {}}
+    written = []
+    for task, (entry, path) in zip(tasks, exported):
+        manifest["shards"][task[1]] = entry
+        if path is not None:
+            written.append(path)
+
+    if not written:
+        manifest["generation"] -= 1
+
+    # Shards of systems or configs which no longer have runs, and compacted deltas
+    kept = {path for name, entry in manifest["shards"].items() for path in shard_files(name, entry)}
+    for path in stale - kept:
+        try:
+            os.unlink(os.path.join(directory, path))
+        except FileNotFoundError:
+            pass
+
+    write_atomic(manifest_path, lambda f: json.dump(manifest, f, indent=2))
+
+    return written
+
+
+def export_parallel(con, path, fmt="json", jobs=2):
+    """Writes the results of all systems to path like export, with jobs worker processes.
+
+    Each worker writes the results of a system to a temporary file, which are
+    then joined in order. Returns the number of results.
+    """
+
+    begin, _, end = LAYOUTS[fmt]
+    systems = con.execute(SYSTEMS).fetchall()
+    options = {name: system_options(con, system) for system, name in systems}
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with worker_pool(con, jobs) as pool:
+        parts = pool.starmap(export_system_worker, [(system, name, directory, fmt) for system, name in systems])
+
+    def write(f):
+        begin(f, options)
+        n = 0
+        for part, runs in parts:
+            if not runs:
+                continue
+            if n:
+                f.write(",")
+            with open(part) as i:
+                shutil.copyfileobj(i, f, 1 << 20)
+            n += runs
+        f.write(end)
+        return n
+
+    try:
+        return write_atomic(path, write)
+    finally:
+        for part, _ in parts:
+            os.unlink(part)
+
+
+def series_path(system, config, benchmark):
+    """Returns the path of a series file, relative to the series directory.
+
+    The names are quoted like those of the shards, so r7rs/fib is the file
+    r7rs%2Ffib.json rather than a subdirectory.
+    """
+
+    return "/".join(urllib.parse.quote(name, safe="") for name in (system, config, benchmark)) + ".json"
+
+
+def write_if_changed(path, contents):
+    """Writes contents to path unless it already holds them. Returns whether it wrote."""
+
+    try:
+        with open(path) as f:
+            if f.read() == contents:
+                return False
+    except OSError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda f: f.write(contents))
+    return True
+
+
+def export_series(con, directory):
+    """Writes the results of each (system, config, benchmark) to its own file, ordered by commit timestamp.
+
+    The index.json file lists them with the options of each system, so that
+    the client only downloads the series it plots:
+
+        {"version": 1, "options": {...}, "commitTimestamps": {system: {commit: ms}},
+         "series": {system: {config: {benchmark: {"path": ..., "runs": ...}}}}}
+
+    Each series holds the results of its runs, without their system, config
+    and benchmark, which are those of the series:
+
+        {"system": ..., "config": ..., "benchmark": ..., "results": [...]}
+
+    Files whose contents did not change are left as they are, and the series
+    of the previous index.json which no longer exist are removed. Returns the
+    number of files written.
+    """
+
+    index_path = os.path.join(directory, "index.json")
+    try:
+        with open(index_path) as f:
+            previous = json.load(f)["series"]
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    index = {"version": SERIES_VERSION, "options": {}, "commitTimestamps": {}, "series": {}}
+    kept = set()
+    written = 0
+
+    for system, system_name in con.execute(SYSTEMS).fetchall():
+        index["options"][system_name] = system_options(con, system)
+        timestamps = index["commitTimestamps"][system_name] = {}
+        series = index["series"][system_name] = {}
+
+        results = with_statistics(run_results(con, system, system_name, None, 0, SERIES))
+        for (config, benchmark), runs in itertools.groupby(results, key=lambda r: (r["config"], r["benchmark"])):
+            runs = list(runs)
+            for r in runs:
+                timestamps[r["commit"]] = r["timestamp"]
+                del r["system"], r["config"], r["benchmark"]
+
+            path = series_path(system_name, config, benchmark)
+            contents = json.dumps({"system": system_name, "config": config, "benchmark": benchmark, "results": runs})
+            written += write_if_changed(os.path.join(directory, *path.split("/")), contents)
+
+            series.setdefault(config, {})[benchmark] = {"path": path, "runs": len(runs)}
+            kept.add(path)
+
+    written += write_if_changed(index_path, json.dumps(index, indent=2))
+
+    # Only the series of the previous index are removed, as the directory may
+    # hold other files, and so are the directories they leave empty
+    for configs in previous.values():
+        for benchmarks in configs.values():
+            for entry in benchmarks.values():
+                path = entry["path"]
+                if path in kept:
+                    continue
+                try:
+                    os.unlink(os.path.join(directory, *path.split("/")))
+                except FileNotFoundError:
+                    continue
+                parent = os.path.dirname(path)
+                while parent:
+                    try:
+                        os.rmdir(os.path.join(directory, *parent.split("/")))
+                    except OSError:
+                        break
+                    parent = os.path.dirname(parent)
+
+    return written
+
+
+def connect(database):
+    """Opens the database read-only, as done by each worker process."""
+
+    return sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(database))}?mode=ro", uri=True)
+
+
+def worker_pool(con, jobs):
+    database = con.execute("PRAGMA database_list").fetchone()[2]
+    return multiprocessing.Pool(jobs, initializer=init_worker, initargs=(database,))
+
+
+# Connection of the worker processes used with --jobs
+_con = None
+
+
+def init_worker(database):
+    global _con
+
+    _con = connect(database)
+
+
+def export_shard_worker(*task):
+    return export_shard(_con, *task)
+
+
+def export_system_worker(system, system_name, directory, fmt):
+    fd, part = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".part")
+    with os.fdopen(fd, "w") as f:
+        runs = LAYOUTS[fmt][1](f, system_results(_con, system, system_name))
+    return part, runs
+
 
-        _system = options[system.name]
+if __name__ == "__main__":
+    args = parser.parse_args()
 
-        _system["commitMessages"] = {c.name:c.description for c in select(c for c in Commit)}
+    config = configparser.ConfigParser()
+    config.read(args.conf)
 
-        _system["commitShas"] = {c.name:c.sha for c in select(c for c in Commit)}
+    logger = init_logger(config)
 
-        _system["benchmarks"] = [b.name for b in select(bench for bench in Benchmark for b in Build for r in Run if b.system == system and bench == r.benchmark)]
+    con = sqlite3.connect(config["SERVER"]["database"])
 
-        _commits = [[c[0], c[1].timestamp()*1000] for c in sorted([(c.name, c.timestamp) for c in select(b.commit for b in _builds)], key=lambda x:x[1])]
-        if debug: logger.info(f"export_json.py ### processing {len(_commits)} commits")
-        _system["commits"] = [c[0] for c in _commits]
+    if args.shards and args.artifacts:
+        parser.error("--artifacts cannot be used with --shards")
+    if (args.delta or args.compact) and not args.shards:
+        parser.error("--delta and --compact require --shards")
 
-        _system["configs"] = [c.name for c in select(b.config for b in _builds)]
+    if args.series:
+        n = export_series(con, args.series)
+        logger.info(f"export_json.py ### Wrote {n} series files to {args.series}")
 
-        _runs = select(r for b in Build for r in Run if b.system == system and b == r.build)
-        if debug: logger.info(f"export_json.py ### processing {len(_runs)} runs")
+    if args.shards:
+        written = export_shards(
+            con, args.shards, args.shard_by, args.format, args.force, args.delta, args.compact, args.jobs
+        )
+        con.close()
+        logger.info(f"export_json.py ### Wrote {len(written)} files to {args.shards} ({' , '.join(written)})")
+        exit()
 
-        output["results"] = [{
-            "system": r.build.system.name,
-            "benchmark": r.benchmark.name,
-            "commit": r.build.commit.name,
-            "timestamp": (r.build.commit.timestamp).timestamp()*1000,
-            "values": r.result.split(' '),
-            "config": r.build.config.name,
-        } for r in _runs]
+    json_path = config["SERVER"]["json"]
+    if args.jobs > 1:
+        n = export_parallel(con, json_path, args.format, args.jobs)
+    else:
+        options, results = export(con)
+        n = write_atomic(json_path, lambda f: FORMATS[args.format](f, options, results))
+    con.close()
 
-_json = json.dumps(output, indent=2)
-json_path = config["SERVER"]["json"]
-with open(json_path, 'w') as f:
-    print(_json, file=f)
+    logger.info(f"export_json.py ### Wrote {json_path} ({n} runs)")
 
-logger.info(f"export_json.py ### Wrote {json_path}")
+    if args.artifacts:
+        publish(json_path, args.artifacts)
@@ -0,0 +1,447 @@
+import time
+import sqlite3
+import logging
+from datetime import datetime
+
+from forensics.collector.parse import read_samples
+from forensics.collector.stats import new_stats, skip, timed
+
+logger = logging.getLogger("forensics")
+
+# Tables looked up by natural key: (natural key columns, all inserted columns)
+DIMENSIONS = {
+    "System": (("name",), ("name", "shortname", "icon", "description", "setup", "url")),
+    "Machine": (("name",), ("name", "shortname", "description", "setup", "specs")),
+    "Benchmark": (("name",), ("name", "shortname", "description", "setup")),
+    "Commit": (("system", "sha"), ("name", "sha", "description", "timestamp", "system", "url", "branch")),
+    "Config": (("system", "name"), ("name", "shortname", "description", "setup", "system")),
+    "Usage": (("system", "name"), ("name", "shortname", "description", "setup", "system")),
+    "Build": (("system", "commit", "machine", "config"), ("timestamp", "result", "system", "commit", "machine", "config")),
+}
+
+
+def sql_datetime(timestamp):
+    """Formats a UNIX timestamp the way PonyORM stores datetimes in SQLite."""
+
+    return datetime.fromtimestamp(int(timestamp)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def quote(columns):
+    return ", ".join(f'"{c}"' for c in columns)
+
+
+def new_batch():
+    """Returns an empty batch of parsed result files, as filled by the collector.
+
+    - builds: {"path", "state", "hash", "data"} for each changed build results file
+    - runs: {"path", "context_path", "build_path", "states", "hashes", "context",
+      "results"} for each changed usage directory
+    - touched: (path, state) of files whose contents did not change
+    - removed: paths of ingested files which no longer exist
+    """
+
+    return {"builds": [], "runs": [], "touched": [], "removed": []}
+
+
+def split_batch(batch):
+    """Splits a batch into one batch per build, with its usages, and one per remaining usage.
+
+    The touched and removed files are in a last batch.
+    """
+
+    runs = {}
+    for r in batch["runs"]:
+        runs.setdefault(r["build_path"], []).append(r)
+
+    parts = []
+    for b in batch["builds"]:
+        parts.append(dict(new_batch(), builds=[b], runs=runs.pop(b["path"], [])))
+    for build_runs in runs.values():
+        parts += [dict(new_batch(), runs=[r]) for r in build_runs]
+    parts.append(dict(new_batch(), touched=batch["touched"], removed=batch["removed"]))
+
+    return parts
+
+
+class BulkLoader:
+    """Writes batches of parsed result files with a few set-based statements.
+
+    Each batch is written in a single transaction: the dimension tables are
+    upserted table by table, then the Build rows, then all Run rows with
+    executemany, and finally the ingest manifest.
+
+    The ids of the dimension and Build rows are cached by natural key. The
+    cache is warmed once and updated as rows are inserted, so only missing
+    rows cost SQL statements.
+    """
+
+    def __init__(self, db_path, check_same_thread=True, stats=None):
+        self.con = sqlite3.connect(db_path, timeout=60, check_same_thread=check_same_thread)
+        # The lookup and insert phases and rows of new_stats()
+        self.stats = new_stats() if stats is None else stats
+        self.con.execute("PRAGMA foreign_keys = ON")
+        self.warm()
+
+    def data_version(self):
+        """Changes whenever another connection commits to the database."""
+
+        return self.con.execute("PRAGMA data_version").fetchone()[0]
+
+    def warm(self):
+        """Loads the ids of all dimension and Build rows, and the builds of the manifest."""
+
+        self.ids = {}
+        for table, (key, columns) in DIMENSIONS.items():
+            self.ids[table] = {
+                tuple(r[1:]): r[0]
+                for r in self.con.execute(f'SELECT "id", {quote(key)} FROM "{table}"')
+            }
+
+        self.version = self.data_version()
+        self.build_keys = {id: key for key, id in self.ids["Build"].items()}
+        self.build_paths = dict(self.con.execute(
+            'SELECT "path", "build" FROM "IngestFile" '
+            'WHERE "build" IS NOT NULL AND "path" LIKE \'%/.forensics-build-results\''
+        ))
+
+    def close(self):
+        self.con.close()
+
+    def manifest(self, prefix=""):
+        """Returns the ingest manifest as {path: (mtime, size, hash, build_id, usage_id)}.
+
+        Only the paths starting with prefix are returned.
+        """
+
+        rows = self.con.execute(
+            'SELECT "path", "mtime", "size", "hash", "build", "usage" FROM "IngestFile" '
+            'WHERE substr("path", 1, ?) = ?',
+            (len(prefix), prefix),
+        )
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def ensure(self, table, rows):
+        """Inserts the rows of a table which are not in the cache yet.
+
+        rows maps natural keys to full rows. Returns the cache of the table,
+        {natural key: id}.
+        """
+
+        key, columns = DIMENSIONS[table]
+        ids = self.ids[table]
+
+        with timed(self.stats, "lookup"):
+            missing = [row for k, row in rows.items() if k not in ids]
+
+            if missing:
+                last = self.con.execute(f'SELECT MAX("id") FROM "{table}"').fetchone()[0] or 0
+                self.con.executemany(
+                    f'INSERT INTO "{table}" ({quote(columns)}) VALUES ({", ".join("?" * len(columns))})',
+                    missing,
+                )
+                # AUTOINCREMENT ids only grow
+                for r in self.con.execute(f'SELECT "id", {quote(key)} FROM "{table}" WHERE "id" > ?', (last,)):
+                    ids[tuple(r[1:])] = r[0]
+
+        return ids
+
+    def load(self, batch, shared=False, dry_run=False):
+        """Writes a batch of parsed result files, see load_batch.
+
+        If the batch breaks a constraint of the database, e.g. a machine
+        renamed without changing its shortname, its builds and usages are
+        loaded one at a time instead, and those which still fail are skipped.
+        They are counted in the skipped directories of the statistics.
+
+        Returns the paths of the run results files which were not loaded.
+        """
+
+        try:
+            return self.load_batch(batch, shared, dry_run)
+        except sqlite3.IntegrityError as e:
+            logger.warning(f"Could not load the batch, loading its builds and usages one at a time (Exception: {str(e)})")
+
+        rejected = []
+        for part in split_batch(batch):
+            try:
+                rejected += self.load_batch(part, shared, dry_run)
+            except sqlite3.IntegrityError as e:
+                paths = [b["path"] for b in part["builds"]] + [r["path"] for r in part["runs"]]
+                logger.error(f"Could not load {' , '.join(paths)}, skipping (Exception: {str(e)})")
+                skip(self.stats, "constraint failed", len(paths))
+                rejected += [r["path"] for r in part["runs"]]
+        return rejected
+
+    def load_batch(self, batch, shared=False, dry_run=False):
+        """Writes a batch of parsed result files in one transaction.
+
+        With shared, other processes may be writing to the database too: the
+        database is locked before the cache is used, and the cache is reloaded
+        if they committed since.
+
+        With dry_run, the batch is checked against the constraints of the
+        database, then rolled back.
+
+        Returns the paths of the run results files which were not loaded, as
+        their build is unknown.
+        """
+
+        start = time.perf_counter()
+        lookup_time = self.stats["time"]["lookup"]
+
+        try:
+            with self.con:
+                if shared:
+                    self.con.execute("BEGIN IMMEDIATE")
+                    if self.data_version() != self.version:
+                        self.warm()
+
+                self.load_builds(batch["builds"])
+                nruns, rejected = self.load_runs(batch["runs"])
+
+                self.con.executemany(
+                    'UPDATE "IngestFile" SET "mtime" = ?, "size" = ? WHERE "path" = ?',
+                    [(state[0], state[1], path) for path, state in batch["touched"]],
+                )
+
+                for path in batch["removed"]:
+                    self.remove(path)
+
+                # Invalidates the entries of the server cache
+                if batch["builds"] or batch["runs"] or batch["removed"]:
+                    self.con.execute(
+                        'UPDATE "Generation" SET "value" = "value" + 1, "modified" = ?', (int(time.time()),)
+                    )
+
+                if dry_run:
+                    self.con.rollback()
+        except Exception:
+            # The cache may hold ids of rows which were rolled back
+            self.warm()
+            raise
+
+        if dry_run:
+            self.warm()
+
+        self.stats["rows"] += len(batch["builds"]) + nruns
+        self.stats["time"]["insert"] += time.perf_counter() - start - (self.stats["time"]["lookup"] - lookup_time)
+
+        # Quiet when nothing changed, as the daemon loads often
+        logger.log(
+            logging.INFO if batch["builds"] or batch["runs"] else logging.DEBUG,
+            f"{'Validated' if dry_run else 'Loaded'} {len(batch['builds'])} builds and {nruns} runs "
+            f"from {len(batch['runs']) - len(rejected)} usages"
+        )
+
+        return rejected
+
+    def load_builds(self, builds):
+        """Upserts System, Machine, Commit, Config and Build rows. Returns {path: build id}."""
+
+        if not builds:
+            return {}
+
+        systems = self.ensure("System", {
+            (d["system-name"],): (
+                d["system-name"], d["system-shortname"], d["system-icon"],
+                d["system-desc"], d["system-setup"], d["system-url"],
+            )
+            for d in (b["data"] for b in builds)
+        })
+
+        machines = self.ensure("Machine", {
+            (d["machine-name"],): (
+                # NOTE: Maybe insert machine elsewhere
+                d["machine-name"], d["machine-shortname"], "change me",
+                d["machine-setup"], d["machine-specs"],
+            )
+            for d in (b["data"] for b in builds)
+        })
+
+        commits = self.ensure("Commit", {
+            (systems[(d["system-name"],)], d["commit-hash"]): (
+                d["commit-name"], d["commit-hash"], d["commit-desc"],
+                sql_datetime(d["commit-timestamp"]), systems[(d["system-name"],)],
+                d["commit-url"], d["commit-branch"],
+            )
+            for d in (b["data"] for b in builds)
+        })
+
+        configs = self.ensure("Config", {
+            (systems[(d["system-name"],)], d["config-name"]): (
+                d["config-name"], d["config-shortname"], d["config-desc"],
+                d["config-setup"], systems[(d["system-name"],)],
+            )
+            for d in (b["data"] for b in builds)
+        })
+
+        keys = {}
+        for b in builds:
+            d = b["data"]
+            system = systems[(d["system-name"],)]
+            keys[b["path"]] = (
+                system,
+                commits[(system, d["commit-hash"])],
+                machines[(d["machine-name"],)],
+                configs[(system, d["config-name"])],
+            )
+
+        # Builds redone since the last pass keep their id
+        existing = self.ids["Build"]
+        self.con.executemany(
+            'UPDATE "Build" SET "timestamp" = ?, "result" = ? WHERE "id" = ?',
+            [
+                (sql_datetime(b["data"]["build-timestamp"]), b["data"]["build-result"], existing[keys[b["path"]]])
+                for b in builds if keys[b["path"]] in existing
+            ],
+        )
+        ids = self.ensure("Build", {
+            keys[b["path"]]: (sql_datetime(b["data"]["build-timestamp"]), b["data"]["build-result"]) + keys[b["path"]]
+            for b in builds
+        })
+
+        build_ids = {b["path"]: ids[keys[b["path"]]] for b in builds}
+        self.build_keys.update((ids[k], k) for k in keys.values())
+
+        # A build results file whose machine, commit or config changed now
+        # names another build. The previous one is removed with its runs, and
+        # the usage files of the config are ingested again by the next pass.
+        for path, build in build_ids.items():
+            previous = self.build_paths.get(path)
+            if previous is not None and previous != build:
+                self.con.execute('DELETE FROM "IngestFile" WHERE "build" = ? AND "path" != ?', (previous, path))
+                # Runs and their samples cascade with the build
+                self.con.execute('DELETE FROM "Build" WHERE "id" = ?', (previous,))
+                self.ids["Build"].pop(self.build_keys.pop(previous, None), None)
+                logger.info(f"Replaced build {previous} of {path} by build {build}")
+
+        self.build_paths.update(build_ids)
+
+        self.con.executemany(
+            'INSERT OR REPLACE INTO "IngestFile" ("path", "mtime", "size", "hash", "build") VALUES (?, ?, ?, ?, ?)',
+            [(b["path"], b["state"][0], b["state"][1], b["hash"], build_ids[b["path"]]) for b in builds],
+        )
+
+        return build_ids
+
+    def load_runs(self, runs):
+        """Replaces the Run rows of each usage directory.
+
+        Returns the number of runs inserted, and the paths of the run results
+        files skipped as their build is unknown.
+
+        Runs are unique by (build, usage, benchmark, timestamp) and carry the
+        hash of their results file. Their results are split into a status and
+        Sample rows.
+        """
+
+        if not runs:
+            return 0, []
+
+        # (build id, system id) of each usage directory
+        builds = {
+            r["build_path"]: (self.build_paths[r["build_path"]], self.build_keys[self.build_paths[r["build_path"]]][0])
+            for r in runs if r["build_path"] in self.build_paths
+        }
+
+        rejected = [r["path"] for r in runs if r["build_path"] not in builds]
+        for path in rejected:
+            # This should never trigger.
+            logger.critical(f"Build not found for {path}, skipping...")
+        runs = [r for r in runs if r["build_path"] in builds]
+
+        usages = self.ensure("Usage", {
+            # TODO: Properly fill usage information. Must emit in forensics.
+            (builds[r["build_path"]][1], r["context"]["usage-name"]): (
+                r["context"]["usage-name"], "change me", "change me",
+                r["context"]["usage-setup"], builds[r["build_path"]][1],
+            )
+            for r in runs
+        })
+
+        # TODO: Fill setup information and discriminate using
+        # setup+name pair.
+        benchmarks = self.ensure("Benchmark", {
+            (d["benchmark-name"],): (d["benchmark-name"], "change me", "change me", "change me")
+            for r in runs for d in r["results"]
+        })
+
+        pairs = [
+            (builds[r["build_path"]][0], usages[(builds[r["build_path"]][1], r["context"]["usage-name"])])
+            for r in runs
+        ]
+
+        # Replace the runs of a previous pass over these usage directories
+        self.con.executemany('DELETE FROM "Run" WHERE "build" = ? AND "usage" = ?', pairs)
+
+        rows = []
+        samples = {}
+        for r, (build, usage) in zip(runs, pairs):
+            # NOTE: We choose the end of the computation as the timestamp.
+            timestamp = sql_datetime(r["context"]["run-end-timestamp"])
+            for d in r["results"]:
+                benchmark = benchmarks[(d["benchmark-name"],)]
+                status, values = read_samples(d["run-result"])
+                rows.append((timestamp, d["run-result"], usage, benchmark, build, r["hashes"][0], status))
+                samples[(build, usage, benchmark, timestamp)] = values
+
+        # A benchmark listed twice in a results file keeps its last result
+        last = self.con.execute('SELECT MAX("id") FROM "Run"').fetchone()[0] or 0
+        self.con.executemany(
+            'INSERT OR REPLACE INTO "Run" ("timestamp", "result", "usage", "benchmark", "build", "hash", "status") '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+        self.con.executemany(
+            'INSERT INTO "Sample" ("run", "iteration", "value") VALUES (?, ?, ?)',
+            (
+                (id, i, value)
+                for id, *key in self.con.execute(
+                    'SELECT "id", "build", "usage", "benchmark", "timestamp" FROM "Run" WHERE "id" > ?', (last,)
+                ).fetchall()
+                for i, value in enumerate(samples[tuple(key)])
+            ),
+        )
+
+        self.con.executemany(
+            'INSERT OR REPLACE INTO "IngestFile" ("path", "mtime", "size", "hash", "build", "usage") VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (path, state[0], state[1], digest, build, usage)
+                for r, (build, usage) in zip(runs, pairs)
+                for path, state, digest in zip((r["path"], r["context_path"]), r["states"], r["hashes"])
+            ],
+        )
+
+        return len(rows), rejected
+
+    def known_hashes(self, paths):
+        """Returns {path: hash} for the given paths which are in the manifest."""
+
+        hashes = {}
+        paths = list(paths)
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            hashes.update(self.con.execute(
+                f'SELECT "path", "hash" FROM "IngestFile" WHERE "path" IN ({", ".join("?" * len(chunk))})',
+                chunk,
+            ))
+        return hashes
+
+    def remove(self, path):
+        """Removes the builds or runs of an ingested file which no longer exists."""
+
+        row = self.con.execute('SELECT "build", "usage" FROM "IngestFile" WHERE "path" = ?', (path,)).fetchone()
+        if row is None:
+            return
+
+        build, usage = row
+        if path.endswith("/.forensics-build-results") and build is not None:
+            # Runs cascade with the build
+            self.con.execute('DELETE FROM "Build" WHERE "id" = ?', (build,))
+            self.ids["Build"].pop(self.build_keys.pop(build, None), None)
+            self.build_paths.pop(path, None)
+        elif path.endswith("/.forensics-run-results") and build is not None and usage is not None:
+            self.con.execute('DELETE FROM "Run" WHERE "build" = ? AND "usage" = ?', (build, usage))
+
+        self.con.execute('DELETE FROM "IngestFile" WHERE "path" = ?', (path,))
+        logger.info(f"Removed results of {path}")
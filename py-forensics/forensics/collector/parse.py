@@ -0,0 +1,214 @@
+import io
+import re
+import logging
+import itertools
+
+logger = logging.getLogger("forensics")
+
+# Columns of the result files, see machine/common-setup
+BUILD_RESULTS_FIELDS = (
+    "system-name", "system-shortname", "system-desc", "system-url", "system-icon",
+    "system-setup", "commit-name", "commit-hash", "commit-branch", "commit-timestamp",
+    "commit-author", "commit-desc", "commit-url", "config-name", "config-shortname",
+    "config-desc", "config-setup", "machine-name", "machine-shortname", "machine-setup",
+    "machine-specs", "build-timestamp", "build-result",
+)
+
+RUN_CONTEXT_FIELDS = (
+    "system-name", "commit-name", "config-name", "usage-name", "usage-setup",
+    "machine-name", "run-start-timestamp", "run-end-timestamp",
+)
+
+RUN_RESULTS_FIELDS = ("benchmark-name", "run-result")
+
+# Fields converted to int, all others are kept as str
+INT_FIELDS = {"commit-timestamp", "build-timestamp", "run-start-timestamp", "run-end-timestamp"}
+
+# A quoted field as produced by machine/stringify, or a bare field
+FIELD = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,\n"]*)', re.S)
+ESCAPE = re.compile(r"\\(.)", re.S)
+ESCAPES = {"n": "\n", "\\": "\\", '"': '"'}
+
+# A sample of a run result, as printed by bc
+NUMBER = re.compile(r"\d+\.?\d*|\.\d+")
+
+
+class ParseError(Exception):
+    pass
+
+
+def unescape(s):
+    """Reverses machine/stringify."""
+
+    if "\\" not in s:
+        return s
+    return ESCAPE.sub(lambda m: ESCAPES.get(m.group(1), m.group(0)), s)
+
+
+def iter_records(text):
+    """Yields the records of a result file as lists of str."""
+
+    pos = 0
+    end = len(text)
+    record = []
+    while pos < end:
+        m = FIELD.match(text, pos)
+        if m.group(1) is not None:
+            record.append(unescape(m.group(1)))
+        else:
+            record.append(m.group(2).rstrip("\r"))
+        pos = m.end()
+        if text.startswith("\r\n", pos):
+            pos += 1
+
+        if pos == end or text[pos] == "\n":
+            # Skip blank lines
+            if record != [""]:
+                yield record
+            record = []
+            pos += 1
+        elif text[pos] == ",":
+            pos += 1
+        else:
+            raise ParseError(f"Unexpected {text[pos]!r} at offset {pos}")
+
+
+def typed(fields, record):
+    data = dict(zip(fields, record))
+    try:
+        for f in INT_FIELDS.intersection(data):
+            data[f] = int(data[f])
+    except ValueError as e:
+        raise ParseError(str(e))
+    return data
+
+
+def parse(text, fields):
+    """Yields the records of a result file as dicts with typed values.
+
+    The header line is optional (some run scripts don't emit one). When
+    present, it may order the columns differently or add extra columns.
+    """
+
+    records = iter_records(text)
+    first = next(records, None)
+    if first is None:
+        return
+
+    if set(fields).issubset(first):
+        indices = [first.index(f) for f in fields]
+    else:
+        indices = None
+        records = itertools.chain([first], records)
+
+    for record in records:
+        if indices is not None:
+            if len(record) != len(first):
+                raise ParseError(f"Expected {len(first)} fields, got {len(record)}")
+            record = [record[i] for i in indices]
+        elif len(record) != len(fields):
+            raise ParseError(f"Expected {len(fields)} fields, got {len(record)}")
+        yield typed(fields, record)
+
+
+def read_pandas(text, fields):
+    """Fallback for files the parser rejects, when pandas is installed."""
+
+    import pandas as pd
+
+    # pandas reads \\ and \" with escapechar, but would turn \n into n
+    text = ESCAPE.sub(lambda m: "\n" if m.group(1) == "n" else m.group(0), text)
+    df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False, escapechar="\\", doublequote=False)
+    if not set(fields).issubset(df.columns):
+        raise ParseError("Missing columns")
+    return [typed(fields, [row[f] for f in fields]) for row in df.to_dict("records")]
+
+
+def read(path, fields):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+
+    try:
+        records = list(parse(text, fields))
+    except ParseError as e:
+        try:
+            records = read_pandas(text, fields)
+        except ImportError:
+            raise e
+        logger.debug(f"Parsed {path} with pandas ({str(e)})")
+
+    if not records:
+        raise ParseError(f"{path} is empty")
+
+    return records
+
+
+def read_samples(result):
+    """Splits a run result into its status and sample values.
+
+    A run result is the space-separated times of the iterations, or a failure
+    such as CRASHED or COMPILEERROR, which becomes the status. Results
+    without any token have the "empty" status.
+    """
+
+    tokens = result.split()
+    status = "ok" if tokens else "empty"
+    values = []
+    for token in tokens:
+        if NUMBER.fullmatch(token):
+            values.append(float(token))
+        elif status == "ok":
+            status = token
+    return status, values
+
+
+def read_build_results(path):
+    """Returns the record of a .forensics-build-results file."""
+
+    return read(path, BUILD_RESULTS_FIELDS)[0]
+
+
+def read_run_context(path):
+    """Returns the record of a .forensics-run-context file."""
+
+    return read(path, RUN_CONTEXT_FIELDS)[0]
+
+
+def read_run_results(path):
+    """Returns the records of a .forensics-run-results file, one per benchmark."""
+
+    return read(path, RUN_RESULTS_FIELDS)
+
+
+# Output of machine/stringify, with LF and CRLF line endings
+CHECK_CASES = [
+    'benchmark-name,run-result\n"fib","1.5 1.25"\n',
+    'benchmark-name,run-result\r\n"fib","1.5 1.25"\r\n"tak","CRASHED"\r\n',
+    'benchmark-name,run-result\n"a, b","say \\"hi\\""\n',
+    'benchmark-name,run-result\r\n"C:\\\\bench","line 1\\nline 2"\r\n',
+    'benchmark-name,run-result\n"trailing \\\\","\\\\\\""\n',
+    'run-result,benchmark-name\r\nbare,"quoted"\r\n',
+]
+
+
+def check_pandas():
+    """Compares the parser with pandas on CHECK_CASES, returns the mismatches."""
+
+    mismatches = []
+    for text in CHECK_CASES:
+        try:
+            ours = list(parse(text, RUN_RESULTS_FIELDS))
+        except ParseError as e:
+            ours = e
+        theirs = read_pandas(text, RUN_RESULTS_FIELDS)
+        if ours != theirs:
+            mismatches.append((text, ours, theirs))
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = check_pandas()
+    for text, ours, theirs in mismatches:
+        print(f"{text!r}:\n  parser: {ours}\n  pandas: {theirs}")
+    print(f"{len(CHECK_CASES) - len(mismatches)}/{len(CHECK_CASES)} cases match pandas.")
+    exit(1 if mismatches else 0)
@@ -0,0 +1,207 @@
+import os
+import time
+import hashlib
+import logging
+
+from forensics import init_logger
+from forensics.models import ls_dir
+from forensics.collector import parse
+from forensics.collector.loader import new_batch
+from forensics.collector.stats import new_stats, skip, timed
+
+logger = logging.getLogger("forensics")
+
+
+def file_state(path):
+    """Returns the (mtime, size) pair used to detect changed result files."""
+
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def is_unchanged(manifest, path, state):
+    known = manifest.get(path)
+    return known is not None and known[0:2] == state and known[3] is not None
+
+
+def read_build_results(path, state, manifest, batch, stats):
+    """Adds a changed build results file to the batch."""
+
+    digest = file_hash(path)
+    known = manifest.get(path)
+    if known is not None and known[2] == digest and known[3] is not None:
+        # Touched but not modified
+        batch["touched"].append((path, state))
+        return
+
+    with timed(stats, "parse"):
+        data = parse.read_build_results(path)
+    stats["files"] += 1
+    stats["bytes"] += state[1]
+
+    batch["builds"].append({
+        "path": path,
+        "state": state,
+        "hash": digest,
+        "data": data,
+    })
+
+
+def read_run_results(run_results, run_context, build_results, states, manifest, batch, stats):
+    """Adds a changed usage directory to the batch."""
+
+    paths = (run_results, run_context)
+    digests = (file_hash(run_results), file_hash(run_context))
+    known = [manifest.get(p) for p in paths]
+    if all(k is not None and k[2] == d and k[3] is not None for k, d in zip(known, digests)):
+        # Touched but not modified
+        batch["touched"] += zip(paths, states)
+        return
+
+    with timed(stats, "parse"):
+        context = parse.read_run_context(run_context)
+        results = parse.read_run_results(run_results)
+    stats["files"] += 2
+    stats["bytes"] += states[0][1] + states[1][1]
+
+    batch["runs"].append({
+        "path": run_results,
+        "context_path": run_context,
+        "build_path": build_results,
+        "states": states,
+        "hashes": digests,
+        "context": context,
+        "results": results,
+    })
+
+
+def scan_commit(commit_path, manifest, stats=None):
+    """Scans the configs of a commit directory for result files changed since the last pass.
+
+    Returns the batch of parsed files and the set of result file paths seen.
+    The time spent, files read and directories skipped are added to stats.
+    """
+
+    if stats is None:
+        stats = new_stats()
+    start = time.perf_counter()
+    parse_time = stats["time"]["parse"]
+
+    batch = new_batch()
+    seen = set()
+
+    commit_path = os.path.abspath(commit_path)
+    system_name = os.path.basename(os.path.dirname(commit_path))
+    commit_name = os.path.basename(commit_path)
+
+    configs = ls_dir(commit_path)
+    for i, config in enumerate(configs):
+        # The remaining configs of the commit are abandoned along with this one
+        abandoned = len(configs) - i
+        build_results = config.path + "/.forensics-build-results"
+        # Don't continue for failed builds.
+        # NOTE: Maybe save failed build state?
+        if not os.path.exists(build_results):
+            logger.warning(
+                f"Build results absent for {system_name}/{commit_name}/{config.name}"
+            )
+            skip(stats, "build results absent", abandoned)
+            break
+
+        seen.add(build_results)
+        state = file_state(build_results)
+        stats["checked"] += 1
+
+        if not is_unchanged(manifest, build_results, state):
+            try:
+                read_build_results(build_results, state, manifest, batch, stats)
+            except Exception as e:
+                logger.warning(
+                        f"Could not process build for {system_name}/{commit_name}/{config.name}, skipping (Exception: {str(e)})"
+                )
+                skip(stats, "build results unreadable", abandoned)
+                break
+
+            logger.debug(
+                    f"Processed build for {system_name}/{commit_name}/{config.name}"
+            )
+
+        if not os.path.exists(config.path + "/.forensics-usage"):
+            logger.warning(
+                f"Usage directory absent for {system_name}/{commit_name}/{config.name}, skipping"
+            )
+            skip(stats, "usage directory absent", abandoned)
+            break
+
+        usages = ls_dir(config.path + "/.forensics-usage")
+        for j, usage in enumerate(usages):
+            run_results = usage.path + "/.forensics-run-results"
+            if not os.path.exists(run_results):
+                logger.warning(
+                    f"Run results absent for {system_name}/{commit_name}/{config.name}, skipping"
+                )
+                # As are the remaining usages of the config
+                skip(stats, "run results absent", len(usages) - j)
+                break
+
+            run_context = usage.path + "/.forensics-run-context"
+            if not os.path.exists(run_context):
+                logger.warning(
+                    f"Run context absent for {system_name}/{commit_name}/{config.name}, skipping"
+                )
+                skip(stats, "run context absent", len(usages) - j)
+                break
+
+            seen.add(run_results)
+            seen.add(run_context)
+            states = (file_state(run_results), file_state(run_context))
+            stats["checked"] += 2
+
+            if (is_unchanged(manifest, run_results, states[0])
+                    and is_unchanged(manifest, run_context, states[1])):
+                continue
+
+            try:
+                read_run_results(run_results, run_context, build_results, states, manifest, batch, stats)
+            except Exception as e:
+                logger.warning(
+                    f"Could not process run for {system_name}/{commit_name}/{config.name}/{usage.name}, skipping"
+                )
+                skip(stats, "run results unreadable")
+                # Don't raise, continue
+
+            logger.debug(
+                f"Processed run for {system_name}/{commit_name}/{config.name}/{usage.name}"
+            )
+
+    stats["time"]["scan"] += time.perf_counter() - start - (stats["time"]["parse"] - parse_time)
+
+    return batch, seen
+
+
+def scan_commit_stats(commit_path, manifest):
+    """scan_commit, returning the statistics of this commit directory too."""
+
+    stats = new_stats()
+    batch, seen = scan_commit(commit_path, manifest, stats)
+    return batch, seen, stats
+
+
+# State of the worker processes used with --jobs
+_manifest = None
+
+
+def init_worker(config, verbose, manifest):
+    global _manifest
+
+    init_logger(config, verbose)
+    _manifest = manifest
+
+
+def scan_commit_worker(commit_path):
+    return scan_commit_stats(commit_path, _manifest)
@@ -0,0 +1,69 @@
+import time
+from contextlib import contextmanager
+
+# Phases of an ingest pass, in order
+PHASES = ("scan", "parse", "lookup", "insert")
+
+
+def new_stats():
+    """Returns empty ingest statistics, as reported by --stats.
+
+    - time: seconds spent in each of PHASES
+    - checked: result files whose state was compared with the manifest
+    - files, bytes: result files read and parsed
+    - rows: Build and Run rows written (or validated with --dry-run)
+    - skipped: {reason: count} of the directories skipped by the scan
+    """
+
+    return {
+        "time": {phase: 0.0 for phase in PHASES},
+        "checked": 0,
+        "files": 0,
+        "bytes": 0,
+        "rows": 0,
+        "skipped": {},
+    }
+
+
+def merge_stats(stats, other):
+    for phase, seconds in other["time"].items():
+        stats["time"][phase] += seconds
+    for k in ("checked", "files", "bytes", "rows"):
+        stats[k] += other[k]
+    for reason, count in other["skipped"].items():
+        stats["skipped"][reason] = stats["skipped"].get(reason, 0) + count
+
+
+def skip(stats, reason, count=1):
+    stats["skipped"][reason] = stats["skipped"].get(reason, 0) + count
+
+
+@contextmanager
+def timed(stats, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats["time"][phase] += time.perf_counter() - start
+
+
+def report(stats, elapsed):
+    """Formats the statistics of a pass which took elapsed seconds."""
+
+    elapsed = max(elapsed, 1e-9)
+    lines = [
+        f"Checked {stats['checked']} result files, parsed {stats['files']} "
+        f"({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.2f} s",
+        f"  {stats['files'] / elapsed:.0f} files/s, {stats['rows'] / elapsed:.0f} rows/s ({stats['rows']} rows)",
+        # With --jobs, scan and parse add up the time of all worker processes
+        "Time per phase:",
+    ]
+    lines += [f"  {phase:<8}{stats['time'][phase]:8.2f} s" for phase in PHASES]
+
+    lines.append("Skipped directories:")
+    if not stats["skipped"]:
+        lines.append("  none")
+    for reason, count in sorted(stats["skipped"].items(), key=lambda x: -x[1]):
+        lines.append(f"  {count:6}  {reason}")
+
+    return "\n".join(lines)
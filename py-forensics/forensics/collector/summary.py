@@ -0,0 +1,78 @@
+import numpy as np
+
+# Statistics of the samples of each run, as plotted by client/v2
+STATISTICS = ("min", "max", "mean", "median", "stddev")
+
+# Number of runs summarized at once by with_statistics
+CHUNK_SIZE = 65536
+
+
+def summarize(counts, values):
+    """Computes the STATISTICS of many runs at once.
+
+    counts holds the number of samples of each run, and values the samples of
+    all runs one after the other. Returns {statistic: array with one value
+    per run}. Like d3 in the client, stddev is the sample standard deviation.
+    Runs without samples (crashed or empty) get NaN for every statistic, and
+    runs with a single sample a stddev of 0.
+    """
+
+    counts = np.asarray(counts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    summary = {s: np.full(len(counts), np.nan) for s in STATISTICS}
+    nonempty = counts > 0
+    if not nonempty.any():
+        return summary
+
+    # Empty runs have no samples, so these starts are strictly increasing
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    n = counts[nonempty]
+
+    summary["min"][nonempty] = np.minimum.reduceat(values, starts)
+    summary["max"][nonempty] = np.maximum.reduceat(values, starts)
+
+    mean = np.add.reduceat(values, starts) / n
+    summary["mean"][nonempty] = mean
+
+    deviations = values - np.repeat(mean, n)
+    squares = np.add.reduceat(deviations * deviations, starts)
+    summary["stddev"][nonempty] = np.sqrt(np.where(n > 1, squares / np.maximum(n - 1, 1), 0))
+
+    # Sort the samples within each run, then average the middle ones
+    runs = np.repeat(np.arange(len(n)), n)
+    ordered = values[np.lexsort((values, runs))]
+    summary["median"][nonempty] = (ordered[starts + (n - 1) // 2] + ordered[starts + n // 2]) / 2
+
+    return summary
+
+
+def with_statistics(results):
+    """Adds the STATISTICS to results, a chunk of runs at a time.
+
+    The statistics of runs without samples are None.
+    """
+
+    chunk = []
+    for r in results:
+        chunk.append(r)
+        if len(chunk) == CHUNK_SIZE:
+            yield from summarize_chunk(chunk)
+            chunk = []
+    yield from summarize_chunk(chunk)
+
+
+def summarize_chunk(chunk):
+    if not chunk:
+        return
+
+    summary = summarize(
+        [len(r["values"]) for r in chunk],
+        [v for r in chunk for v in r["values"]],
+    )
+    # Rounded as the samples are at most to the millisecond
+    columns = [np.round(summary[s], 6).tolist() for s in STATISTICS]
+
+    for r, row in zip(chunk, zip(*columns)):
+        r.update((s, None if v != v else v) for s, v in zip(STATISTICS, row))
+        yield r
@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger("forensics")
+
+# Seconds between two full passes when polling
+POLL_INTERVAL = 30
+
+# Seconds between two full passes with inotify, to catch removals and lost events
+FULL_PASS_INTERVAL = 3600
+
+# Seconds to wait for more events once a run completed
+SETTLE_DELAY = 1
+
+# The periodic-task run and build scripts rename themselves to these on exit
+SCRIPT_PREFIXES = (".forensics-run-script-",)
+
+
+class Watcher:
+    """Reports the commit directories of system directories where runs completed.
+
+    Uses inotify when the inotify_simple module is available, and falls back
+    to polling otherwise. wait() returns either a set of commit directories to
+    ingest, or None when a full pass over all system directories is due.
+    """
+
+    def __init__(self, roots, commit_depth, poll_interval=POLL_INTERVAL):
+        """roots are system directories (commit_depth 1) or build directories (commit_depth 2)."""
+
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.commit_depth = commit_depth
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.last_full_pass = time.monotonic()
+
+        if INotify is None:
+            logger.info("inotify_simple is not installed, polling for results")
+            return
+
+        self.inotify = INotify()
+        self.dirs = {}
+        try:
+            for root in self.roots:
+                self.watch_tree(root, 0)
+        except OSError as e:
+            # Most likely fs.inotify.max_user_watches
+            logger.warning(f"Could not watch {root} ({str(e)}), polling for results")
+            self.inotify.close()
+            self.inotify = None
+
+    def watch_tree(self, path, depth):
+        """Watches path and the directories under it which can hold result files.
+
+        Depths relative to a commit directory: 1 is a config, 2 its
+        .forensics-usage directory and 3 a usage directory.
+        """
+
+        wd = self.inotify.add_watch(path, flags.CREATE | flags.MOVED_TO | flags.ONLYDIR)
+        self.dirs[wd] = (path, depth)
+
+        level = depth - self.commit_depth
+        if level >= 3:
+            return
+
+        for d in os.scandir(path):
+            if not d.is_dir():
+                continue
+            if level == 1 and d.name != ".forensics-usage":
+                # Skip the build tree
+                continue
+            self.watch_tree(d.path, depth + 1)
+
+    def commit_of(self, path, depth):
+        for _ in range(depth - self.commit_depth):
+            path = os.path.dirname(path)
+        return path
+
+    def wait(self):
+        if self.inotify is None:
+            time.sleep(self.poll_interval)
+            return None
+
+        commits = set()
+        while True:
+            remaining = FULL_PASS_INTERVAL - (time.monotonic() - self.last_full_pass)
+            if remaining <= 0:
+                self.last_full_pass = time.monotonic()
+                return None
+
+            timeout = SETTLE_DELAY if commits else remaining
+            events = self.inotify.read(timeout=int(timeout * 1000))
+            if not events:
+                if commits:
+                    return commits
+                continue
+
+            for event in events:
+                if event.mask & flags.Q_OVERFLOW:
+                    logger.warning("inotify queue overflow, doing a full pass")
+                    self.last_full_pass = time.monotonic()
+                    return None
+
+                if event.wd not in self.dirs:
+                    continue
+
+                path, depth = self.dirs[event.wd]
+                child = os.path.join(path, event.name)
+
+                if event.mask & flags.IGNORED:
+                    del self.dirs[event.wd]
+                elif event.mask & flags.ISDIR:
+                    level = depth + 1 - self.commit_depth
+                    if level <= 3 and (level != 2 or event.name == ".forensics-usage"):
+                        try:
+                            self.watch_tree(child, depth + 1)
+                        except OSError as e:
+                            logger.warning(f"Could not watch {child} ({str(e)})")
+                elif event.name.startswith(SCRIPT_PREFIXES) and depth - self.commit_depth == 3:
+                    commits.add(self.commit_of(path, depth))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
@@ -2,15 +2,18 @@ import os
 import sqlite3
 import pkgutil
 import configparser
+import urllib.parse
 from datetime import datetime
 from pony.orm import *
 
-import pandas as pd
-
 from forensics import init_logger
 
 db = Database()
 
+# Bumped whenever schema.sql changes. Older databases are brought up to date by
+# running the templates/upgrade-<version>.sql scripts in order.
+SCHEMA_VERSION = 7
+
 
 # Utils
 def ls_dir(path):
@@ -45,6 +48,7 @@ class Commit(db.Entity):
     builds = Set("Build")
     url = Optional(str)
     branch = Optional(str)
+    composite_key(system, sha)
 
 
 class Config(db.Entity):
@@ -55,6 +59,7 @@ class Config(db.Entity):
     setup = Required(str)
     system = Required(System)
     builds = Set("Build")
+    composite_key(system, name)
 
 
 class Usage(db.Entity):
@@ -65,6 +70,8 @@ class Usage(db.Entity):
     setup = Required(str)
     system = Required(System)
     runs = Set("Run")
+    files = Set("IngestFile")
+    composite_key(system, name)
 
 
 class Benchmark(db.Entity):
@@ -96,6 +103,8 @@ class Build(db.Entity):
     machine = Required(Machine)
     config = Required(Config)
     runs = Set("Run")
+    files = Set("IngestFile")
+    composite_key(system, commit, machine, config)
 
 
 class Run(db.Entity):
@@ -105,9 +114,49 @@ class Run(db.Entity):
     usage = Required(Usage)
     benchmark = Required(Benchmark)
     build = Required(Build)
+    hash = Optional(str, nullable=True)  # sha256 of the run results file
+    status = Required(str, default="ok")  # Otherwise e.g. CRASHED, see parse.read_samples
+    samples = Set("Sample")
+    composite_key(build, usage, benchmark, timestamp)
     # TODO: Add "machine" field as benchmark and build machines can differ
 
 
+class Sample(db.Entity):
+    """One iteration of a run, as parsed from Run.result at ingest time."""
+    run = Required(Run)
+    iteration = Required(int)
+    value = Required(float)
+    PrimaryKey(run, iteration)
+
+
+class IngestFile(db.Entity):
+    """A result file already ingested by the collector, used to skip unchanged files."""
+    path = PrimaryKey(str)
+    mtime = Required(int, size=64)  # st_mtime_ns
+    size = Required(int, size=64)
+    hash = Required(str)  # sha256 of the contents
+    build = Optional(Build)
+    usage = Optional(Usage)
+
+
+class Generation(db.Entity):
+    """A single row, whose value the collector increments whenever it changes the results."""
+    value = Required(int, size=64)
+    modified = Required(int, size=64)  # Unix time of the last increment
+
+
+def has_schema(db_path):
+    """Returns whether db_path is a database with the tables of schema.sql, without creating it."""
+
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Run'").fetchone() is not None
+    finally:
+        conn.close()
+
+
 def init_db(config):
     """Initialize the database if it does not exist."""
 
@@ -122,11 +171,22 @@ def init_db(config):
     db_path = config["SERVER"]["database"]
     schema = pkgutil.get_data("forensics", "templates/schema.sql")
 
-    if os.path.exists(db_path):
+    if has_schema(db_path):
         print("Database already exists.")
+        upgrade_db(config)
         exit()
 
     with sqlite3.connect(db_path) as conn:
+        # An existing file without the schema, e.g. left by an upgrade of a
+        # missing database, is only initialized if none of its tables has rows
+        tables = [t for t, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        if any(conn.execute(f'SELECT 1 FROM "{t}" LIMIT 1').fetchone() for t in tables):
+            print(f"{db_path} is not a forensics database.")
+            exit(1)
+        conn.executescript("".join(f'DROP TABLE "{t}";\n' for t in tables))
+
         with conn:
             conn.executescript(schema.decode("ascii"))
 
@@ -134,6 +194,55 @@ def init_db(config):
     logger.info("Initialized database.")
 
 
+def upgrade_db(config):
+    """Upgrade an existing database to SCHEMA_VERSION, keeping its contents."""
+
+    if isinstance(config, str):
+        _config = config
+        config = configparser.ConfigParser()
+        config.read(os.path.expanduser(_config))
+
+    logger = init_logger(config)
+
+    db_path = config["SERVER"]["database"]
+    if not has_schema(db_path):
+        raise FileNotFoundError(f"No forensics database at {db_path}, create it with --init")
+
+    with sqlite3.connect(db_path, timeout=60, isolation_level=None) as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for v in range(version + 1, SCHEMA_VERSION + 1):
+            upgrade = pkgutil.get_data("forensics", f"templates/upgrade-{v}.sql")
+            # The version is read again once the write lock is held, as the
+            # aggregator's workers all upgrade the database when they start
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= v:
+                conn.execute("ROLLBACK")
+                continue
+            # Not executescript, which would commit the transaction first
+            for statement in split_statements(upgrade.decode("ascii")):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {v}")
+            conn.execute("COMMIT")
+            print(f"Upgraded database to schema version {v}.")
+            logger.info(f"Upgraded database to schema version {v}.")
+
+
+def split_statements(script):
+    """Splits an SQL script into its statements."""
+
+    statements = []
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ""
+    # The last statement of the upgrade scripts has no semicolon
+    if statement.strip():
+        statements.append(statement)
+    return statements
+
+
 # For interactive queries on the DB in a Python shell
 def db_connect(config):
     if isinstance(config, str):
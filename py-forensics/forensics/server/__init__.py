@@ -6,7 +6,7 @@ from forensics.models import *
 # ============== FLASK API =================
 # ==========================================
 
-from flask import Flask, Response
+from flask import Flask, Response, g, request
 from flask_caching import Cache
 from flask_cors import CORS, cross_origin
 
@@ -14,16 +14,113 @@ from flask.views import MethodView
 from pony.flask import Pony
 
 import json
+import base64
+import hashlib
+import itertools
+import urllib.parse
+from datetime import timezone
+
+import numpy as np
+
+from forensics.collector.export_json import js_timestamp
+from forensics.collector.summary import STATISTICS, summarize
+from forensics.server.downsample import lttb
+
+# Shared by the worker processes, see create_app
+cache = Cache()
+
+
+def generation_key(prefix):
+    """Returns a cache key function for the current generation of the database and query.
+
+    The collector increments the generation whenever it changes the results,
+    so entries stay valid until then, and are never recomputed before. The
+    parameters of the query are sorted, so that their order does not matter.
+    """
+
+    def key():
+        query = urllib.parse.urlencode(sorted(request.args.items(multi=True)))
+        return f"{prefix}/{Generation[1].value}?{query}"
+
+    return key
+
+
+def conditional_get():
+    """Answers 304 Not Modified when the client has the response for the current generation.
+
+    The ETag is derived from the generation of the database and the path and
+    query of the request, so nothing else is queried or serialized.
+    """
+
+    if request.method not in ("GET", "HEAD"):
+        return None
+
+    generation = Generation[1]
+    g.etag = f"{generation.value}-{hashlib.sha256(request.full_path.encode()).hexdigest()[:16]}"
+    g.last_modified = datetime.fromtimestamp(generation.modified, timezone.utc)
+
+    # If-None-Match takes precedence, see RFC 9110
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(g.etag)
+    else:
+        not_modified = request.if_modified_since is not None and g.last_modified <= request.if_modified_since
+
+    if not_modified:
+        return Response(status=304)
+
+
+def tag_response(response):
+    if "etag" in g and response.status_code in (200, 304):
+        response.set_etag(g.etag)
+        response.last_modified = g.last_modified
+        # Kept by browsers, but revalidated at each request
+        response.cache_control.no_cache = True
+    return response
 
-# TODO Use global Flask app config
-cache = Cache(config={"CACHE_TYPE": "SimpleCache"})
 
 # taken here : https://stackoverflow.com/questions/354038/how-do-i-check-if-a-string-is-a-number-float
 def str_is_float(s):
     return s.replace('.','',1).isdigit()
 
+
+def legacy_value(result):
+    """Value of a cell of the legacy cube: the first sample of a run result, if all are numbers.
+
+    Run.result is parsed here rather than read from Sample and Run.status, as
+    the cube holds the sample as written in the result file (Sample would
+    turn 1.50 into 1.5) and the whole result of the other runs, so that its
+    output stays the same.
+    """
+
+    split_res = result.split(" ")
+
+    # check if all values are numbers
+    if all(map(str_is_float, split_res)):
+        return split_res[0]
+    return result
+
+
+def legacy_cells(sys):
+    """Returns {(commit id, config id, benchmark id): result} of the runs of a system.
+
+    One query for the whole system, instead of one per cell. The first run
+    of a cell is kept.
+    """
+
+    runs = select(
+        (r.build.commit.id, r.build.config.id, r.benchmark.id, r.id, r.result)
+        for r in Run
+        if r.build.system == sys
+    ).order_by(4)
+
+    cells = {}
+    for commit, config, bench, _, result in runs:
+        cells.setdefault((commit, config, bench), result)
+    return cells
+
+
 class APILegacy(MethodView):
-    @cache.cached(timeout=60)
+    @cache.cached(timeout=0, key_prefix=generation_key("legacy"))
     def get(self):
         systems = select(x for x in System)
         return_value = []
@@ -50,13 +147,13 @@ class APILegacy(MethodView):
 
             # build name
             tags.append(sys.name + "-settings")
-            config_name = list(map(lambda x: x.name, sys.configs))
+            configs = sorted(sys.configs, key=lambda x: x.id)
+            config_name = list(map(lambda x: x.name, configs))
             options.append(config_name)
 
             # benchmark
             tags.append("benchmarks")
-            all_benchmarks = select(x for x in Benchmark)
-            benchmarks = all_benchmarks
+            benchmarks = list(select(x for x in Benchmark))
 
             options.append(list(map(lambda x: x.name, benchmarks)))
 
@@ -66,34 +163,22 @@ class APILegacy(MethodView):
             tags.append("stat")
             options.append(["mean", "sd"])
 
-            
+            # Pivoted in memory from a single query
+            cells = legacy_cells(sys)
 
             data = []
             for commit_id, commit in enumerate(commits):
                 commit_data = []
                 all_zero = True
-                for config in sys.configs:
+                for config in configs:
                     config_data = []
                     for bench in benchmarks:
                         bench_data = []
-                        results = select(
-                            d
-                            for d in Run
-                            if d.build.config == config
-                            and d.build.commit == commit
-                            and d.build.system == sys
-                            and d.benchmark == bench
-                        )
-                        results = list(results)
                         to_append = "0"
-                        if len(results) != 0:
-                            to_append = results[0].result
-                            split_res = results[0].result.split(" ")
-
-                            # check if all values are numbers
-                            if all(map(str_is_float, split_res)):
-                                to_append = split_res[0]
-                        
+                        result = cells.get((commit.id, config.id, bench.id))
+                        if result is not None:
+                            to_append = legacy_value(result)
+
                         if to_append != "0":
                             all_zero = False
 
@@ -122,6 +207,215 @@ class APILegacy(MethodView):
         return Response(json.dumps(return_value), mimetype="application/json")
 
 
+# Number of runs of a page of /api/runs, by default and at most
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Conditions of the filters of /api/runs, by query parameter. The names are
+# resolved with subqueries, so that the covering indexes of schema version 6
+# are used for the joins.
+RUN_FILTERS = {
+    "system": '"Commit"."system" = (SELECT "id" FROM "System" WHERE "name" = :system)',
+    "config": '"Build"."config" IN (SELECT "id" FROM "Config" WHERE "name" = :config)',
+    "machine": '"Build"."machine" IN (SELECT "id" FROM "Machine" WHERE "name" = :machine)',
+    "usage": '"Run"."usage" IN (SELECT "id" FROM "Usage" WHERE "name" = :usage)',
+    "benchmark": '"Run"."benchmark" IN (SELECT "id" FROM "Benchmark" WHERE "name" = :benchmark)',
+    "since": '"Commit"."timestamp" >= :since',
+    "until": '"Commit"."timestamp" < :until',
+}
+
+# Ordered by commit timestamp, then run id, the key of the pages. The CROSS
+# JOINs make SQLite scan the commits in timestamp order, so that a page stops
+# as soon as it is full instead of sorting all the matching runs.
+RUNS = '''
+SELECT "Commit"."timestamp", "Run"."id", "System"."name", "Config"."name", "Machine"."name", "Usage"."name",
+  "Benchmark"."name", "Commit"."name", "Run"."timestamp", "Run"."status"
+FROM "Commit"
+CROSS JOIN "Build" ON "Build"."commit" = "Commit"."id"
+CROSS JOIN "Run" ON "Run"."build" = "Build"."id"
+JOIN "System" ON "System"."id" = "Build"."system"
+JOIN "Config" ON "Config"."id" = "Build"."config"
+JOIN "Machine" ON "Machine"."id" = "Build"."machine"
+JOIN "Usage" ON "Usage"."id" = "Run"."usage"
+JOIN "Benchmark" ON "Benchmark"."id" = "Run"."benchmark"
+WHERE {}
+ORDER BY "Commit"."timestamp", "Run"."id"
+LIMIT :limit
+'''
+
+# Samples of the runs of a page, whose ids are a JSON array
+RUN_SAMPLES = '''
+SELECT "run", "value" FROM "Sample"
+WHERE "run" IN (SELECT "value" FROM json_each(:runs))
+ORDER BY "run", "iteration"
+'''
+
+
+def sql_timestamp(value):
+    """Formats an ISO 8601 date the way datetimes are stored, see loader.sql_datetime."""
+
+    return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def encode_cursor(timestamp, run):
+    """Encodes the commit timestamp (in ms, see js_timestamp) and id of the last run of a page."""
+
+    return base64.urlsafe_b64encode(json.dumps([timestamp, run]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the commit timestamp, formatted as stored, and run id of a cursor."""
+
+    timestamp, run = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(timestamp, (int, float)) or not isinstance(run, int):
+        raise ValueError("Bad cursor")
+    return datetime.fromtimestamp(timestamp / 1000).strftime("%Y-%m-%d %H:%M:%S.%f"), run
+
+
+# Number of points of a series, by default and at most
+SERIES_POINTS = 500
+MAX_SERIES_POINTS = 10000
+
+# Runs of a series, one row per sample, ordered by commit timestamp
+SERIES = '''
+SELECT "Run"."id", "Commit"."name", "Commit"."timestamp", "Run"."status", "Sample"."value"
+FROM "Commit"
+CROSS JOIN "Build" ON "Build"."commit" = "Commit"."id"
+CROSS JOIN "Run" ON "Run"."build" = "Build"."id"
+LEFT JOIN "Sample" ON "Sample"."run" = "Run"."id"
+WHERE "Commit"."system" = (SELECT "id" FROM "System" WHERE "name" = :system)
+  AND "Build"."config" IN (SELECT "id" FROM "Config" WHERE "name" = :config)
+  AND "Run"."benchmark" = (SELECT "id" FROM "Benchmark" WHERE "name" = :benchmark)
+ORDER BY "Commit"."timestamp", "Run"."id", "Sample"."iteration"
+'''
+
+
+class APISeries(MethodView):
+    """The runs of a (system, config, benchmark) series, downsampled to a number of points.
+
+    The query names the system, config and benchmark, the number of points
+    (at least 3) and the statistic of the samples of each run which is
+    plotted, mean by default. The runs are kept by lttb over their commit
+    timestamps and statistic. Runs which failed or have no samples are left
+    out, as their statistics would be plotted as drops to 0:
+
+        {"system": ..., "config": ..., "benchmark": ..., "statistic": ...,
+         "runs": number of runs of the series,
+         "results": [{"id": ..., "commit": ..., "timestamp": ..., "status": ...,
+                      "min": ..., "max": ..., "mean": ..., "median": ...,
+                      "stddev": ...}, ...]}
+
+    Each resolution is cached until the database changes.
+    """
+
+    @cache.cached(timeout=0, key_prefix=generation_key("series"))
+    def get(self):
+        missing = [k for k in ("system", "config", "benchmark") if k not in request.args]
+        if missing:
+            return Response(f"Bad query: missing {', '.join(missing)}\n", status=400)
+
+        try:
+            params = {k: request.args[k] for k in ("system", "config", "benchmark")}
+            points = int(request.args.get("points", SERIES_POINTS))
+            if not 3 <= points <= MAX_SERIES_POINTS:
+                raise ValueError(f"points must be between 3 and {MAX_SERIES_POINTS}")
+            statistic = request.args.get("statistic", "mean")
+            if statistic not in STATISTICS:
+                raise ValueError(f"statistic must be one of {', '.join(STATISTICS)}")
+        except ValueError as e:
+            return Response(f"Bad query: {str(e)}\n", status=400)
+
+        runs = []
+        counts = []
+        values = []
+        rows = db.get_connection().execute(SERIES, params)
+        for run, run_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            run_rows = list(run_rows)
+            _, commit, timestamp, status, _ = run_rows[0]
+            samples = [row[4] for row in run_rows if row[4] is not None]
+            runs.append({"id": run, "commit": commit, "timestamp": js_timestamp(timestamp), "status": status})
+            counts.append(len(samples))
+            values += samples
+
+        summary = summarize(counts, values)
+        plotted = np.flatnonzero([r["status"] == "ok" and n > 0 for r, n in zip(runs, counts)])
+        kept = plotted[lttb([runs[i]["timestamp"] for i in plotted], summary[statistic][plotted], points)]
+
+        results = []
+        for i in kept.tolist():
+            results.append(dict(runs[i], **{s: round(float(summary[s][i]), 6) for s in STATISTICS}))
+
+        return Response(
+            json.dumps(dict(params, statistic=statistic, runs=len(runs), results=results)),
+            mimetype="application/json",
+        )
+
+
+class APIRuns(MethodView):
+    """Runs matching the filters of the query, a page at a time.
+
+    The filters are system, config, machine, usage and benchmark names, and
+    since and until dates (ISO 8601) on the commit timestamp. limit is the
+    size of the page, and after the "next" cursor of the previous page.
+    Timestamps are in milliseconds since the epoch, like those of the
+    export:
+
+        {"runs": [{"id": ..., "system": ..., "config": ..., "machine": ...,
+                   "usage": ..., "benchmark": ..., "commit": ...,
+                   "commitTimestamp": ..., "timestamp": ..., "status": ...,
+                   "values": [...]}, ...],
+         "next": cursor of the next page, or null}
+    """
+
+    def get(self):
+        try:
+            params = {k: request.args[k] for k in RUN_FILTERS if k in request.args}
+            for k in ("since", "until"):
+                if k in params:
+                    params[k] = sql_timestamp(params[k])
+            conditions = [RUN_FILTERS[k] for k in params]
+
+            params["limit"] = int(request.args.get("limit", PAGE_SIZE))
+            if not 0 < params["limit"] <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+            if "after" in request.args:
+                params["after_timestamp"], params["after_run"] = decode_cursor(request.args["after"])
+                # The first condition bounds the scan of the timestamp index
+                conditions.append('"Commit"."timestamp" >= :after_timestamp')
+                conditions.append('("Commit"."timestamp", "Run"."id") > (:after_timestamp, :after_run)')
+        except (ValueError, TypeError) as e:
+            return Response(f"Bad query: {str(e)}\n", status=400)
+
+        con = db.get_connection()
+        rows = con.execute(RUNS.format(" AND ".join(conditions) or "1"), params).fetchall()
+
+        values = {}
+        for run, value in con.execute(RUN_SAMPLES, {"runs": json.dumps([row[1] for row in rows])}):
+            values.setdefault(run, []).append(value)
+
+        runs = [
+            {
+                "id": run,
+                "system": system,
+                "config": config,
+                "machine": machine,
+                "usage": usage,
+                "benchmark": benchmark,
+                "commit": commit,
+                "commitTimestamp": js_timestamp(commit_timestamp),
+                "timestamp": js_timestamp(timestamp),
+                "status": status,
+                "values": values.get(run, []),
+            }
+            for commit_timestamp, run, system, config, machine, usage, benchmark, commit, timestamp, status in rows
+        ]
+        last = runs[-1] if len(rows) == params["limit"] else None
+        cursor = encode_cursor(last["commitTimestamp"], last["id"]) if last else None
+
+        return Response(json.dumps({"runs": runs, "next": cursor}), mimetype="application/json")
+
+
 # ========================================
 # ===== FOLLOWING CODE IS NOT USED TO ====
 # ========= SERVE THE FRONT-END ==========
@@ -241,12 +535,23 @@ def create_app(config):
     app = Flask(__name__)
     Pony(app)
 
-    cache.init_app(app)
+    # After Pony's, so that the generation is read in the db_session
+    app.before_request(conditional_get)
+    app.after_request(tag_response)
+
+    # A directory, so that all gunicorn workers share the entries
+    cache.init_app(app, config={
+        "CACHE_TYPE": "FileSystemCache",
+        "CACHE_DIR": config["SERVER"].get("cache_dir", config["SERVER"]["database"] + ".cache"),
+        "CACHE_DEFAULT_TIMEOUT": 0,
+    })
 
     CORS(app)
     app.config["CORS_HEADERS"] = "Content-Type"
 
     app.add_url_rule('/legacy/', view_func=APILegacy.as_view('legacy'), methods=["GET",])
+    app.add_url_rule('/api/runs', view_func=APIRuns.as_view('runs'), methods=["GET",])
+    app.add_url_rule('/api/series', view_func=APISeries.as_view('series'), methods=["GET",])
 
     db.bind(provider="sqlite", filename=config["SERVER"]["database"])
     db.generate_mapping(create_tables=False)
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def lttb(x, y, n):
+    """Returns the indices of the n points of a series kept by Largest-Triangle-Three-Buckets.
+
+    x must be sorted. The first and last points are always kept. The others
+    are split into n - 2 buckets, and of each bucket the point kept is the
+    one forming the largest triangle with the point kept in the previous
+    bucket and the average of the next one, so that peaks and outliers are
+    preserved. All indices are returned when there are at most n points.
+    """
+
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        raise ValueError("At least 3 points are kept")
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket i holds the points edges[i]:edges[i + 1], the last point is its own bucket
+    edges = (np.arange(n - 1) * ((size - 2) / (n - 2))).astype(np.int64) + 1
+    edges = np.append(edges, size)
+
+    kept = np.empty(n, dtype=np.int64)
+    kept[0] = 0
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2])
+        avg_x, avg_y = x[following].mean(), y[following].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept[i + 1] = a
+    kept[n - 1] = size - 1
+
+    return kept
@@ -36,8 +36,14 @@ CREATE TABLE "Commit" (
   "branch" TEXT NOT NULL
 );
 
+CREATE UNIQUE INDEX "unq_commit__system_sha" ON "Commit" ("system", "sha");
+
 CREATE INDEX "idx_commit__system" ON "Commit" ("system");
 
+CREATE INDEX "idx_commit__system_timestamp" ON "Commit" ("system", "timestamp");
+
+CREATE INDEX "idx_commit__timestamp" ON "Commit" ("timestamp");
+
 CREATE TABLE "Config" (
   "id" INTEGER PRIMARY KEY AUTOINCREMENT,
   "name" TEXT NOT NULL,
@@ -47,6 +53,8 @@ CREATE TABLE "Config" (
   "system" INTEGER NOT NULL REFERENCES "System" ("id") ON DELETE CASCADE
 );
 
+CREATE UNIQUE INDEX "unq_config__system_name" ON "Config" ("system", "name");
+
 CREATE INDEX "idx_config__system" ON "Config" ("system");
 
 CREATE TABLE "Build" (
@@ -59,6 +67,8 @@ CREATE TABLE "Build" (
   "config" INTEGER NOT NULL REFERENCES "Config" ("id") ON DELETE CASCADE
 );
 
+CREATE UNIQUE INDEX "unq_build__system_commit_machine_config" ON "Build" ("system", "commit", "machine", "config");
+
 CREATE INDEX "idx_build__commit" ON "Build" ("commit");
 
 CREATE INDEX "idx_build__config" ON "Build" ("config");
@@ -67,6 +77,8 @@ CREATE INDEX "idx_build__machine" ON "Build" ("machine");
 
 CREATE INDEX "idx_build__system" ON "Build" ("system");
 
+CREATE INDEX "idx_build__commit_system_config_machine" ON "Build" ("commit", "system", "config", "machine");
+
 CREATE TABLE "Usage" (
   "id" INTEGER PRIMARY KEY AUTOINCREMENT,
   "name" TEXT NOT NULL,
@@ -76,6 +88,8 @@ CREATE TABLE "Usage" (
   "system" INTEGER NOT NULL REFERENCES "System" ("id") ON DELETE CASCADE
 );
 
+CREATE UNIQUE INDEX "unq_usage__system_name" ON "Usage" ("system", "name");
+
 CREATE INDEX "idx_usage__system" ON "Usage" ("system");
 
 CREATE TABLE "Run" (
@@ -84,11 +98,49 @@ CREATE TABLE "Run" (
   "result" TEXT NOT NULL,
   "usage" INTEGER NOT NULL REFERENCES "Usage" ("id") ON DELETE CASCADE,
   "benchmark" INTEGER NOT NULL REFERENCES "Benchmark" ("id") ON DELETE CASCADE,
-  "build" INTEGER NOT NULL REFERENCES "Build" ("id") ON DELETE CASCADE
+  "build" INTEGER NOT NULL REFERENCES "Build" ("id") ON DELETE CASCADE,
+  "hash" TEXT,
+  "status" TEXT NOT NULL DEFAULT 'ok'
 );
 
+CREATE UNIQUE INDEX "unq_run__build_usage_benchmark_timestamp" ON "Run" ("build", "usage", "benchmark", "timestamp");
+
 CREATE INDEX "idx_run__benchmark" ON "Run" ("benchmark");
 
 CREATE INDEX "idx_run__build" ON "Run" ("build");
 
-CREATE INDEX "idx_run__usage" ON "Run" ("usage")
+CREATE INDEX "idx_run__usage" ON "Run" ("usage");
+
+CREATE INDEX "idx_run__build_benchmark_usage_status_timestamp" ON "Run" ("build", "benchmark", "usage", "status", "timestamp");
+
+CREATE TABLE "Sample" (
+  "run" INTEGER NOT NULL REFERENCES "Run" ("id") ON DELETE CASCADE,
+  "iteration" INTEGER NOT NULL,
+  "value" REAL NOT NULL,
+  PRIMARY KEY ("run", "iteration")
+);
+
+CREATE INDEX "idx_sample__run_iteration_value" ON "Sample" ("run", "iteration", "value");
+
+CREATE TABLE "IngestFile" (
+  "path" TEXT PRIMARY KEY,
+  "mtime" INTEGER NOT NULL,
+  "size" INTEGER NOT NULL,
+  "hash" TEXT NOT NULL,
+  "build" INTEGER REFERENCES "Build" ("id") ON DELETE SET NULL,
+  "usage" INTEGER REFERENCES "Usage" ("id") ON DELETE SET NULL
+);
+
+CREATE INDEX "idx_ingestfile__build" ON "IngestFile" ("build");
+
+CREATE INDEX "idx_ingestfile__usage" ON "IngestFile" ("usage");
+
+CREATE TABLE "Generation" (
+  "id" INTEGER PRIMARY KEY CHECK ("id" = 1),
+  "value" INTEGER NOT NULL,
+  "modified" INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO "Generation" ("id", "value", "modified") VALUES (1, 0, CAST(strftime('%s', 'now') AS INTEGER));
+
+PRAGMA user_version = 7
@@ -0,0 +1,12 @@
+CREATE TABLE "IngestFile" (
+  "path" TEXT PRIMARY KEY,
+  "mtime" INTEGER NOT NULL,
+  "size" INTEGER NOT NULL,
+  "hash" TEXT NOT NULL,
+  "build" INTEGER REFERENCES "Build" ("id") ON DELETE SET NULL,
+  "usage" INTEGER REFERENCES "Usage" ("id") ON DELETE SET NULL
+);
+
+CREATE INDEX "idx_ingestfile__build" ON "IngestFile" ("build");
+
+CREATE INDEX "idx_ingestfile__usage" ON "IngestFile" ("usage")
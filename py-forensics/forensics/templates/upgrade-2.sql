@@ -0,0 +1,13 @@
+DELETE FROM "Run" WHERE "id" NOT IN (
+  SELECT MAX("id") FROM "Run" GROUP BY "build", "usage", "benchmark", "timestamp"
+);
+
+ALTER TABLE "Run" ADD COLUMN "hash" TEXT;
+
+UPDATE "Run" SET "hash" = (
+  SELECT "hash" FROM "IngestFile"
+  WHERE "IngestFile"."build" = "Run"."build" AND "IngestFile"."usage" = "Run"."usage"
+    AND "IngestFile"."path" LIKE '%/.forensics-run-results'
+);
+
+CREATE UNIQUE INDEX "unq_run__build_usage_benchmark_timestamp" ON "Run" ("build", "usage", "benchmark", "timestamp")
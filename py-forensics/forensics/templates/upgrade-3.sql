@@ -0,0 +1,30 @@
+ALTER TABLE "Run" ADD COLUMN "status" TEXT NOT NULL DEFAULT 'ok';
+
+CREATE TABLE "Sample" (
+  "run" INTEGER NOT NULL REFERENCES "Run" ("id") ON DELETE CASCADE,
+  "iteration" INTEGER NOT NULL,
+  "value" REAL NOT NULL,
+  PRIMARY KEY ("run", "iteration")
+);
+
+CREATE TEMP TABLE "Token" AS
+WITH RECURSIVE "split" ("run", "position", "token", "rest") AS (
+  SELECT "id", 0, NULL, trim("result") || ' ' FROM "Run"
+  UNION ALL
+  SELECT "run", "position" + 1, substr("rest", 1, instr("rest", ' ') - 1), substr("rest", instr("rest", ' ') + 1)
+  FROM "split" WHERE "rest" != ''
+)
+SELECT "run", "position", "token",
+  "token" NOT GLOB '*[^0-9.]*' AND "token" NOT GLOB '*.*.*' AND "token" != '.' AS "numeric"
+FROM "split" WHERE "token" != '';
+
+INSERT INTO "Sample" ("run", "iteration", "value")
+SELECT "run", ROW_NUMBER() OVER (PARTITION BY "run" ORDER BY "position") - 1, CAST("token" AS REAL)
+FROM "Token" WHERE "numeric";
+
+UPDATE "Run" SET "status" = coalesce(
+  (SELECT "token" FROM "Token" WHERE "Token"."run" = "Run"."id" AND NOT "numeric" ORDER BY "position" LIMIT 1),
+  CASE WHEN EXISTS (SELECT 1 FROM "Token" WHERE "Token"."run" = "Run"."id") THEN 'ok' ELSE 'empty' END
+);
+
+DROP TABLE "Token"
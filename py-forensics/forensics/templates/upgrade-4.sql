@@ -0,0 +1,6 @@
+CREATE TABLE "Generation" (
+  "id" INTEGER PRIMARY KEY CHECK ("id" = 1),
+  "value" INTEGER NOT NULL
+);
+
+INSERT INTO "Generation" ("id", "value") VALUES (1, 0)
@@ -0,0 +1,3 @@
+ALTER TABLE "Generation" ADD COLUMN "modified" INTEGER NOT NULL DEFAULT 0;
+
+UPDATE "Generation" SET "modified" = CAST(strftime('%s', 'now') AS INTEGER)
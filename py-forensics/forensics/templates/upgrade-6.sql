@@ -0,0 +1,9 @@
+CREATE INDEX "idx_commit__system_timestamp" ON "Commit" ("system", "timestamp");
+
+CREATE INDEX "idx_commit__timestamp" ON "Commit" ("timestamp");
+
+CREATE INDEX "idx_build__commit_system_config_machine" ON "Build" ("commit", "system", "config", "machine");
+
+CREATE INDEX "idx_run__build_benchmark_usage_status_timestamp" ON "Run" ("build", "benchmark", "usage", "status", "timestamp");
+
+CREATE INDEX "idx_sample__run_iteration_value" ON "Sample" ("run", "iteration", "value")
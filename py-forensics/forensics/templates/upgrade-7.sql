@@ -0,0 +1,86 @@
+CREATE TEMP TABLE "CommitMap" ("old" INTEGER PRIMARY KEY, "new" INTEGER NOT NULL);
+
+INSERT INTO "CommitMap" SELECT "id", MIN("id") OVER (PARTITION BY "system", "sha") FROM "Commit";
+
+CREATE TEMP TABLE "ConfigMap" ("old" INTEGER PRIMARY KEY, "new" INTEGER NOT NULL);
+
+INSERT INTO "ConfigMap" SELECT "id", MIN("id") OVER (PARTITION BY "system", "name") FROM "Config";
+
+CREATE TEMP TABLE "UsageMap" ("old" INTEGER PRIMARY KEY, "new" INTEGER NOT NULL);
+
+INSERT INTO "UsageMap" SELECT "id", MIN("id") OVER (PARTITION BY "system", "name") FROM "Usage";
+
+UPDATE "Build" SET
+  "commit" = (SELECT "new" FROM "CommitMap" WHERE "old" = "Build"."commit"),
+  "config" = (SELECT "new" FROM "ConfigMap" WHERE "old" = "Build"."config");
+
+CREATE TEMP TABLE "BuildMap" ("old" INTEGER PRIMARY KEY, "new" INTEGER NOT NULL);
+
+INSERT INTO "BuildMap"
+SELECT "id", MIN("id") OVER (PARTITION BY "system", "commit", "machine", "config") FROM "Build";
+
+-- Key of every run once its build and usage are replaced by the kept ones
+CREATE TEMP TABLE "RunKey" (
+  "id" INTEGER PRIMARY KEY,
+  "build" INTEGER NOT NULL,
+  "usage" INTEGER NOT NULL,
+  "benchmark" INTEGER NOT NULL,
+  "timestamp" DATETIME NOT NULL,
+  "moved" INTEGER NOT NULL
+);
+
+INSERT INTO "RunKey"
+SELECT "Run"."id", "BuildMap"."new", "UsageMap"."new", "Run"."benchmark", "Run"."timestamp",
+  "BuildMap"."new" != "BuildMap"."old" OR "UsageMap"."new" != "UsageMap"."old"
+FROM "Run"
+JOIN "BuildMap" ON "BuildMap"."old" = "Run"."build"
+JOIN "UsageMap" ON "UsageMap"."old" = "Run"."usage";
+
+-- Of the runs which become duplicates, the latest one is kept, as in upgrade-2.sql.
+-- Foreign keys are not enforced by upgrade_db, so their samples are deleted explicitly.
+DELETE FROM "RunKey" WHERE "id" NOT IN (
+  SELECT MAX("id") FROM "RunKey" GROUP BY "build", "usage", "benchmark", "timestamp"
+);
+
+DELETE FROM "Sample" WHERE "run" NOT IN (SELECT "id" FROM "RunKey");
+
+DELETE FROM "Run" WHERE "id" NOT IN (SELECT "id" FROM "RunKey");
+
+UPDATE "Run" SET
+  "build" = (SELECT "build" FROM "RunKey" WHERE "RunKey"."id" = "Run"."id"),
+  "usage" = (SELECT "usage" FROM "RunKey" WHERE "RunKey"."id" = "Run"."id")
+WHERE "id" IN (SELECT "id" FROM "RunKey" WHERE "moved");
+
+UPDATE "IngestFile" SET "build" = (SELECT "new" FROM "BuildMap" WHERE "old" = "IngestFile"."build")
+WHERE "build" IS NOT NULL;
+
+UPDATE "IngestFile" SET "usage" = (SELECT "new" FROM "UsageMap" WHERE "old" = "IngestFile"."usage")
+WHERE "usage" IS NOT NULL;
+
+DELETE FROM "Build" WHERE "id" IN (SELECT "old" FROM "BuildMap" WHERE "old" != "new");
+
+DELETE FROM "Commit" WHERE "id" IN (SELECT "old" FROM "CommitMap" WHERE "old" != "new");
+
+DELETE FROM "Config" WHERE "id" IN (SELECT "old" FROM "ConfigMap" WHERE "old" != "new");
+
+DELETE FROM "Usage" WHERE "id" IN (SELECT "old" FROM "UsageMap" WHERE "old" != "new");
+
+DROP TABLE "CommitMap";
+
+DROP TABLE "ConfigMap";
+
+DROP TABLE "UsageMap";
+
+DROP TABLE "BuildMap";
+
+DROP TABLE "RunKey";
+
+UPDATE "Generation" SET "value" = "value" + 1, "modified" = CAST(strftime('%s', 'now') AS INTEGER);
+
+CREATE UNIQUE INDEX "unq_commit__system_sha" ON "Commit" ("system", "sha");
+
+CREATE UNIQUE INDEX "unq_config__system_name" ON "Config" ("system", "name");
+
+CREATE UNIQUE INDEX "unq_usage__system_name" ON "Usage" ("system", "name");
+
+CREATE UNIQUE INDEX "unq_build__system_commit_machine_config" ON "Build" ("system", "commit", "machine", "config")
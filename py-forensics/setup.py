@@ -9,8 +9,8 @@ setup(name='forensics',
       url='https://github.com/udem-dlteam/forensics',
       packages=['forensics'],
       install_requires=[
-          'pandas',
           'pony',
+          'numpy',
           'flask',
           'flask-cors',
           'flask-caching',